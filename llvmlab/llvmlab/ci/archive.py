@@ -0,0 +1,141 @@
+"""
+Archive of old builds moved out of the CI status.
+"""
+
+import gzip
+import os
+import struct
+import zlib
+
+from flask import json
+
+class BuildArchive(object):
+    """
+    BuildArchive object for keeping old builds in a compressed file, one JSON
+    build record per line.
+
+    Each batch of archived builds is appended as a separate gzip member, so
+    archiving never rewrites the file. A build may be archived more than once
+    (if we crash before the status is saved), in which case the last record
+    wins.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+        # Whether the file has been checked for an incomplete last member.
+        self.checked = False
+
+    def get_complete_length(self):
+        """
+        get_complete_length() -> int
+
+        Get the length of the complete gzip members at the start of the archive
+        (if we crashed in the middle of a write, the last member may be
+        incomplete).
+        """
+
+        file = open(self.path, 'rb')
+        try:
+            complete = 0
+            position = 0
+            decompressor = None
+            while 1:
+                data = file.read(1 << 16)
+                if not data:
+                    break
+                while data:
+                    if decompressor is None:
+                        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+                    try:
+                        decompressor.decompress(data)
+                    except zlib.error:
+                        return complete
+
+                    # Any data past the end of a member is the next member.
+                    unused = decompressor.unused_data
+                    if not unused:
+                        position += len(data)
+                        break
+                    position += len(data) - len(unused)
+                    complete = position
+                    decompressor = None
+                    data = unused
+
+            # Check whether the last member is complete, in which case any
+            # further data is unused.
+            if decompressor is not None:
+                try:
+                    decompressor.decompress('\0')
+                except zlib.error:
+                    return complete
+                if decompressor.unused_data == '\0':
+                    complete = position
+            return complete
+        finally:
+            file.close()
+
+    def append(self, builds):
+        """
+        append(builds)
+
+        Append the given builds to the archive.
+        """
+
+        builds = list(builds)
+        if not builds:
+            return
+
+        # Drop any incomplete member left by a crash, otherwise the builds we
+        # append would not be readable.
+        if not self.checked:
+            if os.path.exists(self.path):
+                length = self.get_complete_length()
+                if length != os.path.getsize(self.path):
+                    file = open(self.path, 'r+b')
+                    try:
+                        file.truncate(length)
+                    finally:
+                        file.close()
+            self.checked = True
+
+        file = gzip.open(self.path, 'ab')
+        try:
+            for build in builds:
+                file.write(json.dumps(build.todata()) + '\n')
+        finally:
+            file.close()
+
+    def read(self, names = None):
+        """
+        read(names = None) -> iter
+
+        Read the archived build data (see BuildStatus.todata()), optionally only
+        for the given builders, in the order the builds were archived.
+        """
+
+        if not os.path.exists(self.path):
+            return
+
+        if names is not None:
+            names = set(names)
+        file = gzip.open(self.path, 'rb')
+        try:
+            while 1:
+                # If we crashed in the middle of a write, the last member may be
+                # incomplete.
+                try:
+                    line = file.readline()
+                except (IOError, EOFError, struct.error, zlib.error):
+                    break
+                if not line:
+                    break
+                try:
+                    data = json.loads(line)
+                except ValueError:
+                    break
+
+                if names is None or data['name'] in names:
+                    yield data
+        finally:
+            file.close()
@@ -0,0 +1,121 @@
+"""
+Persistent HTTP connections for talking to a buildbot master.
+"""
+
+import httplib
+import threading
+import urlparse
+import zlib
+
+class ConnectionPool(object):
+    """
+    ConnectionPool object for issuing HTTP GET requests to a single server over
+    a bounded set of keep-alive connections.
+
+    The pool also tracks how many connections were created and how many
+    requests reused an existing connection.
+    """
+
+    def __init__(self, url, size = 1, timeout = 60.):
+        parsed = urlparse.urlsplit(url)
+        if parsed.scheme == 'https':
+            self.connection_class = httplib.HTTPSConnection
+        elif parsed.scheme == 'http':
+            self.connection_class = httplib.HTTPConnection
+        else:
+            raise ValueError, "Unsupported URL scheme: %r" % url
+        self.netloc = parsed.netloc
+        self.base_path = parsed.path.rstrip('/')
+        self.size = size
+        self.timeout = timeout
+
+        # The idle connections, and a semaphore bounding how many connections
+        # may be in use at once.
+        self.idle_connections = []
+        self.lock = threading.Lock()
+        self.semaphore = threading.BoundedSemaphore(size)
+
+        # Statistics.
+        self.connections_created = 0
+        self.connections_reused = 0
+        self.bytes_received = 0
+
+    def create_connection(self):
+        with self.lock:
+            self.connections_created += 1
+        return self.connection_class(self.netloc, timeout = self.timeout)
+
+    def acquire_connection(self):
+        with self.lock:
+            if self.idle_connections:
+                self.connections_reused += 1
+                return self.idle_connections.pop(), True
+        return self.create_connection(), False
+
+    def release_connection(self, connection):
+        with self.lock:
+            self.idle_connections.append(connection)
+
+    def close(self):
+        with self.lock:
+            connections = self.idle_connections
+            self.idle_connections = []
+        for connection in connections:
+            connection.close()
+
+    def request(self, connection, path, headers):
+        connection.request('GET', self.base_path + path, headers = headers)
+        response = connection.getresponse()
+        data = response.read()
+        return response, data
+
+    def get(self, path, headers = {}):
+        """
+        get(path, headers = {}) -> (status, headers, data)
+
+        Issue a GET request for the given path (relative to the pool URL) and
+        return the response status, a dictionary of the (lowercased) response
+        headers, and the decoded response body.
+
+        Network failures are reported as httplib.HTTPException or socket.error.
+        """
+
+        request_headers = { 'Accept-Encoding' : 'gzip' }
+        request_headers.update(headers)
+
+        self.semaphore.acquire()
+        try:
+            connection,reused = self.acquire_connection()
+            try:
+                response,data = self.request(connection, path, request_headers)
+            except:
+                connection.close()
+                if not reused:
+                    raise
+
+                # The server may have dropped an idle connection, retry once on
+                # a new connection.
+                connection = self.create_connection()
+                try:
+                    response,data = self.request(connection, path,
+                                                 request_headers)
+                except:
+                    connection.close()
+                    raise
+
+            # Return the connection to the pool, if it is still usable.
+            if response.will_close:
+                connection.close()
+            else:
+                self.release_connection(connection)
+        finally:
+            self.semaphore.release()
+
+        with self.lock:
+            self.bytes_received += len(data)
+
+        response_headers = dict(response.getheaders())
+        if response_headers.get('content-encoding') == 'gzip':
+            data = zlib.decompress(data, 16 + zlib.MAX_WBITS)
+
+        return response.status, response_headers, data
@@ -0,0 +1,74 @@
+"""
+Caching of JSON responses from a buildbot master.
+"""
+
+import collections
+import threading
+
+class CacheEntry(object):
+    __slots__ = ('obj', 'etag', 'last_modified', 'immutable')
+
+    def __init__(self, obj, etag, last_modified, immutable):
+        self.obj = obj
+        self.etag = etag
+        self.last_modified = last_modified
+        self.immutable = immutable
+
+class ResponseCache(object):
+    """
+    ResponseCache object for remembering decoded responses by URL, along with
+    the validators (ETag and Last-Modified) needed to revalidate them with a
+    conditional GET.
+
+    Entries marked immutable never need to be revalidated. The cache holds at
+    most max_entries entries, evicting the least recently used.
+    """
+
+    def __init__(self, max_entries = 1000):
+        self.max_entries = max_entries
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+        # Statistics.
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is not None:
+                self.entries[key] = entry
+            return entry
+
+    def put(self, key, obj, etag = None, last_modified = None,
+            immutable = False):
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = CacheEntry(obj, etag, last_modified, immutable)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last = False)
+
+    def invalidate_prefix(self, prefix):
+        """
+        invalidate_prefix(prefix) -> int
+
+        Remove all the entries whose key starts with the given prefix, returning
+        the number of entries removed.
+        """
+
+        with self.lock:
+            keys = [key for key in self.entries
+                    if key.startswith(prefix)]
+            for key in keys:
+                del self.entries[key]
+            return len(keys)
+
+    def record(self, hit):
+        with self.lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
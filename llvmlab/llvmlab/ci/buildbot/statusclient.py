@@ -1,9 +1,20 @@
+import Queue
+import heapq
+import httplib
+import random
+import socket
+import sys
+import threading
 import time
 import traceback
+import urllib
 import urllib2
 import StringIO
 from flask import json
 
+from llvmlab.ci.buildbot import connectionpool
+from llvmlab.ci.buildbot import responsecache
+
 ###
 
 # Custom Exception Classes
@@ -16,6 +27,79 @@ class UnknownFailure(Exception):
 
 ###
 
+def is_valid_packet(packet):
+    """
+    is_valid_packet(packet) -> bool
+
+    Check that a packet pushed by a master has the shape push_packet() expects:
+    a dictionary, whose payload (if any) is a dictionary, whose build (if any)
+    is a dictionary with a string builder name.
+    """
+
+    if not isinstance(packet, dict):
+        return False
+    payload = packet.get('payload')
+    if payload is None:
+        return True
+    if not isinstance(payload, dict):
+        return False
+    build = payload.get('build')
+    if build is None:
+        return True
+    return (isinstance(build, dict) and
+            isinstance(build.get('builderName'), basestring))
+
+###
+
+class WorkerPool(object):
+    """
+    WorkerPool object for running tasks on a bounded set of daemon threads.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.tasks = Queue.Queue()
+        self.threads = []
+        for i in range(size):
+            thread = threading.Thread(target = self.run_worker)
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def run_worker(self):
+        while 1:
+            task = self.tasks.get()
+            if task is None:
+                return
+            func, args, results = task
+            try:
+                results.put((args, True, func(*args)))
+            except:
+                results.put((args, False, sys.exc_info()))
+
+    def submit(self, func, args, results):
+        """
+        submit(func, args, results)
+
+        Call func(*args) on the pool, and put an (args, ok, value) item on the
+        results queue when it completes, where value is the result if ok, or the
+        exception info otherwise.
+        """
+
+        self.tasks.put((func, args, results))
+
+    def close(self):
+        """
+        close()
+
+        Stop the worker threads, once they have finished the submitted tasks.
+        """
+
+        for i in range(self.size):
+            self.tasks.put(None)
+
+###
+
 class BuilderInfo(object):
     """
     BuilderInfo object for tracking per-builder status information being
@@ -45,6 +129,11 @@ class BuilderInfo(object):
         self.active_builds = set(active_builds)
         self.last_poll = last_poll
 
+        # Transient scheduling state, see StatusClient.schedule_builder().
+        self.next_poll = -1
+        self.poll_interval = None
+        self.failures = 0
+
 class StatusClient(object):
     """
     StatusClient object for watching a buildbot master and dispatching signals
@@ -53,6 +142,9 @@ class StatusClient(object):
     Currently, the client primarily is worried about tracking builders.
     """
 
+    # The maximum number of builds to request in a single 'select' query.
+    max_builds_per_request = 50
+
     @staticmethod
     def fromdata(data):
         version = data['version']
@@ -65,6 +157,7 @@ class StatusClient(object):
                     for b in data['builders']]
         sc.builders = dict((b.name, b) for b in builders)
         sc.last_builders_poll = data['last_builders_poll']
+        sc.reset_schedule()
         return sc
 
     def todata(self):
@@ -78,7 +171,9 @@ class StatusClient(object):
 
     def __init__(self, master_url,
                  builders_poll_rate = 60.0,
-                 builder_poll_rate = 5.0):
+                 builder_poll_rate = 5.0,
+                 pool_size = 1, connections = None, cache_size = 1000,
+                 idle_poll_limit = 60.0, failure_backoff_limit = 600.0):
         # Normalize the master URL.
         self.master_url = master_url
         if self.master_url.endswith('/'):
@@ -92,58 +187,367 @@ class StatusClient(object):
         self.builders_poll_rate = float(builders_poll_rate)
         self.builder_poll_rate = float(builder_poll_rate)
 
+        # When the master pushes status updates to us (see push_packet()),
+        # polling only needs to reconcile any missed updates, at this rate.
+        self.reconcile_poll_rate = None
+
+        # Set the limits for how far we back off polling idle builders, and
+        # polling after failures.
+        self.idle_poll_limit = float(idle_poll_limit)
+        self.failure_backoff_limit = float(failure_backoff_limit)
+
         # Set last poll time so we will repoll on startup.
         self.last_builders_poll = -1
 
+        # Initialize the poll schedule, a priority queue of (next poll time,
+        # builder name) items.
+        self.poll_queue = []
+        self.next_builders_poll = -1
+        self.builders_failures = 0
+
+        # The builders being fetched on the worker pool, by name, and the queue
+        # of their results. The results are delivered by pull_events(), which
+        # is the only place builders are updated from polls.
+        self.fetching = {}
+        self.fetch_results = Queue.Queue()
+
+        # Set the number of builders to poll concurrently, and create the pool
+        # of persistent connections to the master.
+        self.pool = None
+        self.connection_pool = None
+        self.set_pool_size(pool_size, connections)
+
+        # The builds results downloaded during the current sweep, keyed by
+        # (builder name, build number).
+        self.build_cache = {}
+
+        # The cache of responses we can revalidate (or never need to refetch),
+        # keyed by path.
+        self.response_cache = responsecache.ResponseCache(cache_size)
+
         # Option logger object.
         self.logger = None
 
-    def get_json_result(self, query_items, arguments=None):
+    def set_pool_size(self, pool_size, connections = None):
+        """
+        set_pool_size(pool_size, connections = None)
+
+        Set the number of builders to poll concurrently, and the number of
+        persistent connections to keep to the master (by default, one per
+        worker). The worker pool is created on first use.
+        """
+
+        # Any fetches still running on the old pool are delivered as usual.
+        self.pool_size = int(pool_size)
+        if self.pool is not None:
+            self.pool.close()
+        self.pool = None
+        if connections is None:
+            connections = max(1, self.pool_size)
+        if self.connection_pool is not None:
+            self.connection_pool.close()
+        self.connection_pool = connectionpool.ConnectionPool(
+            self.master_url, int(connections))
+
+    def log_failure(self, query_items, arguments, url, message = None):
+        os = StringIO.StringIO()
+        print >>os, "*** ERROR: failure in 'get_json_result(%r, %r)' ***" %(
+            query_items, arguments)
+        print >>os, "URL: %r" % url
+        if message is None:
+            print >>os, "\n-- Traceback --"
+            traceback.print_exc(file = os)
+        else:
+            print >>os, message
+        if self.logger:
+            self.logger.warning(os.getvalue())
+        else:
+            print >>sys.stderr, os.getvalue()
+
+    def log_builder_failure(self, builder, exc_info):
+        os = StringIO.StringIO()
+        print >>os, "*** ERROR: failure polling builder %r ***" % (
+            builder.name,)
+        print >>os, "\n-- Traceback --"
+        traceback.print_exception(exc_info[0], exc_info[1], exc_info[2],
+                                  file = os)
+        if self.logger:
+            self.logger.warning(os.getvalue())
+        else:
+            print >>sys.stderr, os.getvalue()
+
+    def get_json_path(self, query_items, arguments=None):
         path = '/json/' + '/'.join(urllib2.quote(item)
                                    for item in query_items)
         if arguments is not None:
-            path += '?' + urllib2.urlencode(arguments)
+            path += '?' + urllib.urlencode(arguments)
+        return path
+
+    def get_json_result(self, query_items, arguments=None):
+        path = self.get_json_path(query_items, arguments)
+
+        # Check the response cache. Immutable results are never refetched,
+        # otherwise we issue a conditional request.
+        entry = self.response_cache.get(path)
+        headers = {}
+        if entry is not None:
+            if entry.immutable:
+                self.response_cache.record(True)
+                return entry.obj
+            if entry.etag is not None:
+                headers['If-None-Match'] = entry.etag
+            if entry.last_modified is not None:
+                headers['If-Modified-Since'] = entry.last_modified
 
         url = self.master_url + path
         try:
-            request = urllib2.urlopen(url)
-        except urllib2.HTTPError, err:
-            # Turn 404 into a result missing error.
-            if err.code == 404:
-                raise ResultMissing
-
-            # Log this failure.
-            os = StringIO.StringIO()
-            print >>os, "*** ERROR: failure in 'get_json_result(%r, %r)' ***" %(
-                query_items, arguments)
-            print >>os, "URL: %r" % url
-            print >>os, "\n-- Traceback --"
-            traceback.print_exc(file = os)
-            if self.logger:
-                self.logger.warning(os.getvalue())
-            else:
-                print >>sys.stderr, os.getvalue()
+            status,response_headers,data = self.connection_pool.get(path,
+                                                                    headers)
+        except (httplib.HTTPException, socket.error):
+            self.log_failure(query_items, arguments, url)
+            raise UnknownFailure
+
+        # If the result is unchanged, reuse the cached object.
+        if status == 304 and entry is not None:
+            self.response_cache.record(True)
+            return entry.obj
+        self.response_cache.record(False)
+
+        # Turn 404 into a result missing error.
+        if status == 404:
+            raise ResultMissing
+        if status != 200:
+            self.log_failure(query_items, arguments, url,
+                             "HTTP status: %d" % status)
             raise UnknownFailure
-        data = request.read()
-        request.close()
 
         obj = json.loads(data)
+
+        # Remember the result, if the master gave us a way to revalidate it.
+        etag = response_headers.get('etag')
+        last_modified = response_headers.get('last-modified')
+        if etag is not None or last_modified is not None:
+            self.response_cache.put(path, obj, etag, last_modified)
+
         return obj
 
+    def invalidate_builder(self, builder_name):
+        """
+        invalidate_builder(builder_name)
+
+        Forget all the cached responses for a builder, for when its build
+        history has been reset or it has been removed (build numbers may then be
+        reused).
+        """
+
+        self.response_cache.invalidate_prefix(
+            self.get_json_path(('builders', builder_name)) + '/')
+
+    def reset_schedule(self):
+        """
+        reset_schedule()
+
+        Rebuild the poll schedule from the last poll times.
+        """
+
+        self.poll_queue = []
+        for builder in self.builders.values():
+            builder.poll_interval = self.get_builder_poll_rate()
+            self.reschedule_builder(builder)
+        self.next_builders_poll = (self.last_builders_poll +
+                                   self.get_builders_poll_rate())
+
+    def get_builder_poll_rate(self):
+        if self.reconcile_poll_rate is not None:
+            return max(self.builder_poll_rate, self.reconcile_poll_rate)
+        return self.builder_poll_rate
+
+    def get_builders_poll_rate(self):
+        if self.reconcile_poll_rate is not None:
+            return max(self.builders_poll_rate, self.reconcile_poll_rate)
+        return self.builders_poll_rate
+
+    def get_next_poll_time(self):
+        """
+        get_next_poll_time() -> float
+
+        Return the time at which the next poll is due.
+        """
+
+        # Discard any stale entries at the head of the queue.
+        while self.poll_queue:
+            next_poll,name = self.poll_queue[0]
+            builder = self.builders.get(name)
+            if builder is not None and builder.next_poll == next_poll:
+                return min(next_poll, self.next_builders_poll)
+            heapq.heappop(self.poll_queue)
+
+        return self.next_builders_poll
+
+    def schedule_builder(self, builder, next_poll):
+        builder.next_poll = next_poll
+        heapq.heappush(self.poll_queue, (next_poll, builder.name))
+
+    def get_backoff_delay(self, poll_rate, failures):
+        # Use exponential backoff, with jitter so failing builders don't retry
+        # in lockstep.
+        delay = min(poll_rate * 2 ** failures, self.failure_backoff_limit)
+        return delay * random.uniform(.5, 1.)
+
+    def builder_polled(self, builder, is_active):
+        """
+        builder_polled(builder, is_active)
+
+        Update the poll interval for a builder which was successfully polled.
+        Builders with activity are polled at the builder poll rate, idle ones
+        back off exponentially up to the idle poll limit.
+        """
+
+        builder.last_poll = time.time()
+        builder.failures = 0
+        if is_active or builder.poll_interval is None:
+            builder.poll_interval = self.get_builder_poll_rate()
+        else:
+            builder.poll_interval = min(builder.poll_interval * 2,
+                                        max(self.idle_poll_limit,
+                                            self.get_builder_poll_rate()))
+
+    def builder_failed(self, builder):
+        builder.failures += 1
+
+    def reschedule_builder(self, builder):
+        if builder.failures:
+            # Presumably a transient network issue, just wait a while and retry.
+            next_poll = time.time() + self.get_backoff_delay(
+                self.get_builder_poll_rate(), builder.failures)
+        else:
+            next_poll = builder.last_poll + builder.poll_interval
+        self.schedule_builder(builder, next_poll)
+
     def pull_events(self):
         current_time = time.time()
 
+        # Start a new sweep.
+        self.build_cache = {}
+
         # Update the builders set, but not all the time (there is no short query
         # for this in the buildbot JSON interface).
-        if current_time - self.last_builders_poll >= self.builders_poll_rate:
+        if current_time >= self.next_builders_poll:
             for event in self.pull_builders():
                 yield event
 
-        # Update the current builds for each known builder.
-        for builder in self.builders.values():
-            if current_time - builder.last_poll >= self.builder_poll_rate:
-                for event in self.pull_builder(builder):
-                    yield event
+        # Deliver the results of any fetches from an earlier sweep, which the
+        # consumer stopped before receiving, so no builder is polled while it is
+        # still being fetched.
+        for event in self.pull_fetched_events():
+            yield event
+
+        # Find the builders which are due to be polled.
+        builders = []
+        while self.poll_queue and self.poll_queue[0][0] <= current_time:
+            next_poll,name = heapq.heappop(self.poll_queue)
+
+            # Ignore stale entries, for builders which have been removed or
+            # rescheduled.
+            builder = self.builders.get(name)
+            if builder is None or builder.next_poll != next_poll:
+                continue
+            builder.next_poll = None
+            builders.append(builder)
+
+        # Update the current builds for each due builder. The builders are only
+        # ever updated and rescheduled from this thread, as the events are
+        # delivered.
+        pending = set(builders)
+        try:
+            if self.pool_size <= 1 or len(builders) <= 1:
+                for builder in builders:
+                    args = (builder, builder.last_build_number,
+                            sorted(builder.active_builds))
+                    try:
+                        ok, value = True, self.fetch_builder(*args)
+                    except Exception:
+                        ok, value = False, sys.exc_info()
+                    pending.remove(builder)
+                    for event in self.pull_builder_events(args, ok, value):
+                        yield event
+                return
+
+            # Otherwise, fetch the builders concurrently, and deliver the events
+            # for each as its results arrive.
+            if self.pool is None:
+                self.pool = WorkerPool(self.pool_size)
+            for builder in builders:
+                args = (builder, builder.last_build_number,
+                        sorted(builder.active_builds))
+                self.fetching[builder.name] = builder
+                self.pool.submit(self.fetch_builder, args, self.fetch_results)
+                pending.remove(builder)
+            for event in self.pull_fetched_events():
+                yield event
+        finally:
+            # If the consumer stopped early, don't drop any builder which wasn't
+            # polled from the schedule.
+            poll_rate = self.get_builder_poll_rate()
+            for builder in pending:
+                if builder.name in self.builders:
+                    self.schedule_builder(builder, time.time() + poll_rate)
+
+    def pull_fetched_events(self):
+        while self.fetching:
+            args, ok, value = self.fetch_results.get()
+            del self.fetching[args[0].name]
+            for event in self.pull_builder_events(args, ok, value):
+                yield event
+
+    def pull_builder_events(self, args, ok, value):
+        """
+        pull_builder_events(args, ok, value) -> iter
+
+        Deliver the events for the result of fetch_builder(*args), then
+        reschedule the builder. The builder is updated as each event is
+        delivered, so if the consumer stops early the rest are reported by the
+        next poll.
+        """
+
+        builder, last_build_number, active_builds = args
+
+        # Ignore builders which were removed while being fetched.
+        if self.builders.get(builder.name) is not builder:
+            return
+
+        stopped = True
+        try:
+            # If a pushed packet updated the builder while it was being fetched,
+            # the results may be stale, just poll it again.
+            if (builder.last_build_number != last_build_number or
+                builder.active_builds != set(active_builds)):
+                self.schedule_builder(builder, -1)
+                return
+
+            if ok:
+                try:
+                    for event in self.apply_builder(builder, *value):
+                        yield event
+                    stopped = False
+                    return
+                except Exception:
+                    value = sys.exc_info()
+
+            # Failures to fetch have already been logged.
+            stopped = False
+            if not issubclass(value[0], UnknownFailure):
+                self.log_builder_failure(builder, value)
+            self.builder_failed(builder)
+        finally:
+            # Leave the builder alone if it was scheduled in the meantime (by a
+            # pushed packet), and poll it again straight away if the consumer
+            # stopped part way through its events.
+            if builder.next_poll is None:
+                if stopped:
+                    self.schedule_builder(builder, -1)
+                else:
+                    self.reschedule_builder(builder)
 
     def pull_builders(self):
         # Pull the builder names.
@@ -152,14 +556,13 @@ class StatusClient(object):
         #yield ('poll_builders',)
         try:
             res = self.get_json_result(('builders',))
-        except ResultMissing:
-            # This should never happen, but don't crash if it does.
-            return
-        except UnknownFailure:
-            # Presumably a transient network issue, just wait a while and retry.
-            #
-            # FIXME: Evaluate decay algorithm.
-            self.last_builders_poll = time.time() + 60.
+        except (ResultMissing, UnknownFailure):
+            # This should never be missing, but don't crash if it is. Otherwise
+            # this is presumably a transient network issue, just wait a while
+            # and retry.
+            self.builders_failures += 1
+            self.next_builders_poll = time.time() + self.get_backoff_delay(
+                self.get_builders_poll_rate(), self.builders_failures)
             return
 
         builder_names = set(res.keys())
@@ -167,90 +570,254 @@ class StatusClient(object):
 
         for name in builder_names - current_builders:
             yield ('added_builder', name)
-            self.builders[name] = BuilderInfo(name)
+            builder = self.builders[name] = BuilderInfo(name)
+            self.schedule_builder(builder, -1)
         for name in current_builders - builder_names:
             yield ('removed_builder', name)
             self.builders.pop(name)
+            self.invalidate_builder(name)
 
         self.last_builders_poll = time.time()
+        self.builders_failures = 0
+        self.next_builders_poll = (self.last_builders_poll +
+                                   self.get_builders_poll_rate())
+
+    def push_packet(self, packet):
+        """
+        push_packet(packet) -> iter
+
+        Process a status packet pushed by the master (in the format sent by the
+        buildbot HttpStatusPush status target), yielding the same events that
+        polling would report.
+        """
+
+        if not is_valid_packet(packet):
+            raise ValueError, "invalid status packet: %r" % (packet,)
+        kind = packet.get('event')
+        payload = packet.get('payload') or {}
+
+        # For builder changes, just refresh the builder list.
+        if kind in ('builderAdded', 'builderRemoved'):
+            self.next_builders_poll = -1
+            return
+
+        if kind not in ('buildStarted', 'buildFinished'):
+            return
+
+        # If we don't know enough about this builder to apply the update, poll
+        # it instead.
+        res = payload.get('build') or {}
+        builder = self.builders.get(res.get('builderName'))
+        if builder is None:
+            self.next_builders_poll = -1
+            return
+        if builder.last_build_number is None or 'number' not in res:
+            self.schedule_builder(builder, -1)
+            return
+
+        # If the build is too far ahead of what we know (or the number is
+        # bogus), poll the builder rather than trusting the packet.
+        number = res['number']
+        if (not isinstance(number, (int, long)) or
+            number - builder.last_build_number > self.max_builds_per_request):
+            self.schedule_builder(builder, -1)
+            return
+
+        # Record the build for the current sweep, so it doesn't need to be
+        # fetched. Pushed results are only kept there (and never in the response
+        # cache), so polling can still correct them.
+        self.build_cache[(builder.name, number)] = res
+        times = res.get('times')
+        is_completed = times and len(times) == 2 and times[1] is not None
 
-    def pull_builder(self, builder):
-        # Get the latest build number.
+        # Add any new builds.
+        if number > builder.last_build_number:
+            for id in range(builder.last_build_number + 1, number + 1):
+                yield ('add_build', builder.name, id)
+                builder.active_builds.add(id)
+            builder.last_build_number = number
+
+        if is_completed and number in builder.active_builds:
+            yield ('completed_build', builder.name, number)
+            builder.active_builds.remove(number)
+
+    def get_builds(self, builder_name, ids):
+        """
+        get_builds(builder_name, ids) -> dict
+
+        Fetch the results for several builds of a builder using the buildbot
+        'select' query, which returns many builds in a single request. The
+        result maps each requested id to its JSON result, or None if the build
+        is not available.
+
+        Every build returned is also recorded in the per-sweep build cache, see
+        get_build(), and completed builds are recorded in the response cache so
+        they are never fetched again.
+        """
+
+        # Completed builds never change, don't refetch any we already have.
+        results = {}
+        ids_to_fetch = []
+        for id in ids:
+            entry = None
+            if id >= 0:
+                entry = self.response_cache.get(self.get_json_path((
+                            'builders', builder_name, 'builds', str(id))))
+            if entry is not None and entry.immutable:
+                self.response_cache.record(True)
+                results[id] = entry.obj
+            else:
+                ids_to_fetch.append(id)
+
+        for i in range(0, len(ids_to_fetch), self.max_builds_per_request):
+            chunk = ids_to_fetch[i:i + self.max_builds_per_request]
+            res = self.get_json_result(('builders', builder_name, 'builds'),
+                                       [('select', str(id)) for id in chunk])
+            for id in chunk:
+                item = res.get(str(id))
+                if not item or 'error' in item:
+                    item = None
+                else:
+                    # Key the caches by the actual number, so queries for the
+                    # latest build ('-1') are reusable.
+                    number = item['number']
+                    self.build_cache[(builder_name, number)] = item
+                    times = item.get('times')
+                    if times and len(times) == 2 and times[1] is not None:
+                        self.response_cache.put(self.get_json_path((
+                                    'builders', builder_name, 'builds',
+                                    str(number))), item, immutable = True)
+                results[id] = item
+        return results
+
+    def get_build(self, builder_name, id):
+        """
+        get_build(builder_name, id) -> obj
+
+        Get the result for a single build, reusing the result downloaded during
+        the current sweep if there is one.
+        """
+
+        res = self.build_cache.get((builder_name, id))
+        if res is None:
+            res = self.get_json_result(('builders', builder_name, 'builds',
+                                        str(id)))
+        return res
+
+    def fetch_builder(self, builder, last_build_number, active_builds):
+        """
+        fetch_builder(builder, last_build_number, active_builds)
+            -> (number, needs_reset, new_builds, results)
+
+        Fetch the results needed to bring a builder with the given state up to
+        date, see apply_builder(). This runs on the worker threads, so it must
+        not use anything but the builder name.
+        """
+
+        builder_name = builder.name
+
+        # Get the latest build number and the results for the active builds, in
+        # one request.
         try:
-            res = self.get_json_result(('builders', builder.name, 'builds',
-                                        '-1'))
-            number = res['number']
+            results = self.get_builds(builder_name, [-1] + active_builds)
         except ResultMissing:
-            # If the server returned 404, then either we gave a bogus builder
-            # name (which is bad), or there are no builds yet.
+            # If the server returned 404, then we gave a bogus builder name
+            # (which is bad).
             #
             # We assume that bogus builder's will be figured out elsewhere, so
             # just assume there are no builds.
-            builder.last_poll = time.time()
+            results = {}
+
+        # If there is no latest build, then there are no builds yet.
+        latest = results.pop(-1, None)
+        if latest is None:
             number = None
-        except UnknownFailure:
-            # Presumably a transient network issue, just wait a while and retry.
-            #
-            # FIXME: Evaluate decay algorithm.
-            builder.last_poll = time.time() + 60.
-            return
+        else:
+            number = latest['number']
+            results[number] = latest
 
-        # Check if we don't have any builds.
+        # Determine if we need to start or reset the state, and which builds are
+        # new.
+        needs_reset = False
+        new_builds = []
         if number is None:
-            # Check if we need to start or reset the state.
-            if builder.last_build_number is not None:
-                yield ('reset_builder', builder.name)
+            needs_reset = last_build_number is not None
         else:
-            # Check if we need to start or reset the state.
-            if (builder.last_build_number is None or
-                number < builder.last_build_number):
-                # Send a reset event.
-                yield ('reset_builder', builder.name)
-                builder.last_build_number = number - 1
+            first_build = last_build_number
+            if first_build is None or number < first_build:
+                needs_reset = True
+                first_build = number - 1
+            new_builds = range(first_build + 1, number + 1)
+
+        # If the build history was reset, the build numbers of the old history
+        # may be reused, so forget any results we have for them (other than the
+        # latest build, which was just fetched).
+        refetch_builds = []
+        if needs_reset and last_build_number is not None:
+            self.invalidate_builder(builder_name)
+            refetch_builds = [id for id in results if id != number]
+            for id in refetch_builds:
+                del results[id]
+
+        # Fetch the new builds we don't have results for yet, so that the build
+        # cache is populated for the consumer.
+        missing_builds = [id for id in new_builds
+                          if id not in results]
+        missing_builds.extend(refetch_builds)
+        if missing_builds:
+            try:
+                results.update(self.get_builds(builder_name, missing_builds))
+            except ResultMissing:
+                pass
 
-            # Add any potentially active builds.
-            for id in range(builder.last_build_number + 1, number + 1):
-                yield ('add_build', builder.name, id)
-                builder.active_builds.add(id)
+        return number, needs_reset, new_builds, results
 
-        # Update the latest build number.
-        builder.last_build_number = number
+    def apply_builder(self, builder, number, needs_reset, new_builds,
+                      results):
+        """
+        apply_builder(builder, number, needs_reset, new_builds, results) -> iter
+
+        Update a builder from the results of fetch_builder(), yielding the
+        events. The builder is updated before each event is yielded, so it
+        always reflects exactly the events which were delivered.
+        """
+
+        if needs_reset:
+            # Send a reset event.
+            if number is None:
+                builder.last_build_number = None
+            else:
+                builder.last_build_number = number - 1
+            yield ('reset_builder', builder.name)
+
+        # Add any potentially active builds, updating the latest build number.
+        for id in new_builds:
+            builder.active_builds.add(id)
+            builder.last_build_number = id
+            yield ('add_build', builder.name, id)
 
         # Analyze the active builds.
         builds = list(builder.active_builds)
         builds.sort()
         for id in builds:
-            # Get the result for this build.
-            try:
-                res = self.get_json_result(('builders', builder.name, 'builds',
-                                            str(id)))
-            except ResultMissing:
-                # This probably shouldn't ever happen, but if it does then trust
-                # the response.
-                res = {}
-            except UnknownFailure:
-                # Presumably a transient network issue, just wait a while and
-                # retry.
-                #
-                # FIXME: Evaluate decay algorithm.
-                builder.last_poll = time.time() + 60.
-                return
-
+            # Get the result for this build. If the build is missing it probably
+            # shouldn't ever happen, but if it does then trust the response.
+            res = results.get(id) or {}
             times = res.get('times')
 
             # In rare circumstances, we could have accessed an invalid build,
             # check for this.
             if times is None or len(times) != 2:
-                yield ('invalid_build', builder.name, id)
                 builder.active_builds.remove(id)
+                yield ('invalid_build', builder.name, id)
                 continue
 
             # Otherwise, just check to see if the build is done.
             if times[1] is not None:
-                yield ('completed_build', builder.name, id)
                 builder.active_builds.remove(id)
+                yield ('completed_build', builder.name, id)
 
-        builder.last_poll = time.time()
+        self.builder_polled(builder, bool(new_builds or builder.active_builds))
 
 ###
 
@@ -263,6 +830,12 @@ def main():
 
 A simple tool for testing the BuildBot StatusClient.
 """)
+    parser.add_option("", "--pool-size", dest="pool_size", type=int,
+                      help="number of builders to poll concurrently [%default]",
+                      default=1)
+    parser.add_option("", "--connections", dest="connections", type=int,
+                      help="number of connections to keep to the master",
+                      default=None)
     opts, args = parser.parse_args()
     if len(args) != 2:
         parser.error("invalid arguments")
@@ -285,16 +858,21 @@ A simple tool for testing the BuildBot StatusClient.
     # Create a new client instance if necessary.
     if sc is None:
         sc = StatusClient(master_url)
+    sc.set_pool_size(opts.pool_size, opts.connections)
 
     # Now wait for events and print them
     try:
         while 1:
             for event in sc.pull_events():
                 print time.time(), event
-            time.sleep(.1)
+            time.sleep(max(0., sc.get_next_poll_time() - time.time()))
     except KeyboardInterrupt:
         print "(interrupted, stopping)"
 
+    print "connections created: %d, reused: %d" % (
+        sc.connection_pool.connections_created,
+        sc.connection_pool.connections_reused)
+
     # Save the current instance.
     file = open(path, "w")
     json.dump(sc.todata(), file)
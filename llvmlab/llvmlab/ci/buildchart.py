@@ -0,0 +1,189 @@
+"""
+Build chart information for the dashboard.
+
+Tracks the completed builds run on each slave, ordered by start time, so that
+the chart of recent builds can be computed without scanning the full status.
+"""
+
+import bisect
+import time
+
+from llvmlab import util
+
+class ChartItem(object):
+    def __init__(self, build, color, left, width):
+        self.build = build
+        self.color = color
+        self.left = left
+        self.width = width
+
+class BuildChart(object):
+    """
+    BuildChart object for computing the chart of recent builds by slave.
+
+    The completed builds are indexed by slave and start time, and kept up to
+    date from the status changes. Computed charts are cached per (days,
+    pixels_per_minute) until the status changes, or for at most cache_timeout
+    seconds (as builds age out of the window).
+    """
+
+    # The maximum number of computed charts to keep.
+    max_cached_charts = 16
+
+    def __init__(self, status, cache_timeout = 60.):
+        self.status = status
+        self.cache_timeout = cache_timeout
+
+        # Map of slave name to the list of (start_time, builder name, number,
+        # build) entries for completed builds, ordered by start time.
+        self.slave_builds = {}
+
+        # Map of (builder name, number) to the slave of each indexed build, and
+        # of builder name to the numbers of its indexed builds.
+        self.build_slaves = {}
+        self.builder_numbers = {}
+
+        # Map of (days, pixels_per_minute) to (compute time, chart).
+        self.charts = {}
+
+        with self.status.lock:
+            for build in self.status.find_builds(completed = True):
+                self.add_build(build)
+            self.status.add_listener(self.status_changed)
+
+    def add_build(self, build):
+        if build.start_time is None or build.end_time is None:
+            return
+
+        key = (build.name, build.number)
+        entry = (build.start_time, build.name, build.number, build)
+        bisect.insort(self.slave_builds.setdefault(build.slave, []), entry)
+        self.build_slaves[key] = (build.slave, build.start_time)
+        self.builder_numbers.setdefault(build.name, set()).add(build.number)
+
+    def remove_build(self, name, number):
+        info = self.build_slaves.pop((name, number), None)
+        if info is None:
+            return
+
+        slave,start_time = info
+        builds = self.slave_builds[slave]
+        index = bisect.bisect_left(builds, (start_time, name, number))
+        del builds[index]
+        if not builds:
+            del self.slave_builds[slave]
+        self.builder_numbers[name].discard(number)
+
+    def remove_builds_before(self, name, number):
+        for n in list(self.builder_numbers.get(name, ())):
+            if n < number:
+                self.remove_build(name, n)
+
+    def remove_builder_builds(self, name):
+        for number in list(self.builder_numbers.get(name, ())):
+            self.remove_build(name, number)
+        self.builder_numbers.pop(name, None)
+
+    def status_changed(self, change):
+        kind = change[0]
+        if kind in ('remove_builder', 'reset_builder'):
+            self.remove_builder_builds(change[1])
+        elif kind == 'remove_build':
+            _,name,number = change
+            self.remove_build(name, number)
+        elif kind == 'archive_builds':
+            _,name,number = change
+            self.remove_builds_before(name, number)
+        elif kind == 'load_builds':
+            _,name,numbers = change
+            for number in numbers:
+                build = self.status.store.get_build(name, number)
+                if build is not None:
+                    self.add_build(build)
+        elif kind == 'update_build':
+            name,number = change[1]['name'], change[1]['number']
+            self.remove_build(name, number)
+            build = self.status.store.get_build(name, number)
+            if build is not None:
+                self.add_build(build)
+
+        # Any change invalidates the computed charts (adding a builder changes
+        # the builder colors).
+        self.charts = {}
+
+    def get_chart(self, days, pixels_per_minute, current_time = None):
+        """
+        get_chart(days, pixels_per_minute, current_time = None) -> dict
+
+        Get the chart of the builds started in the last given number of days,
+        as a dictionary of:
+          data - a map of slave name to a list of rows of ChartItems, one row
+                 per builder,
+          max_x - the width of the chart, in pixels.
+        """
+
+        if current_time is None:
+            current_time = time.time()
+
+        key = (days, pixels_per_minute)
+        item = self.charts.get(key)
+        if (item is not None and
+            0 <= current_time - item[0] < self.cache_timeout):
+            return item[1]
+
+        with self.status.lock:
+            chart = self.compute_chart(days, pixels_per_minute, current_time)
+            if len(self.charts) >= self.max_cached_charts:
+                self.charts = {}
+            self.charts[key] = (current_time, chart)
+        return chart
+
+    def compute_chart(self, days, pixels_per_minute, current_time):
+        # Find the builds within the desired time frame, for each slave.
+        min_start_time = current_time - 60 * 60 * 24 * days
+        slave_builders = {}
+        for slave,entries in self.slave_builds.items():
+            index = bisect.bisect_left(entries, (min_start_time,))
+            while (index != len(entries) and
+                   entries[index][0] <= min_start_time):
+                index += 1
+            if index != len(entries):
+                slave_builders[slave] = [build
+                                         for _,_,_,build in entries[index:]]
+        if not slave_builders:
+            return { 'data' : {}, 'max_x' : 0 }
+
+        # Compute the build chart.
+        builders = self.status.get_builder_names()
+        builder_colors = dict((name, util.make_dark_color(float(i) /
+                                                          len(builders)))
+                              for i,name in enumerate(builders))
+        build_chart_data = {}
+        max_x = 0
+        min_time = min(builds[0].start_time
+                       for builds in slave_builders.values())
+        for slave, builders in slave_builders.items():
+            # Aggregate builds by builder type (the builds are already ordered
+            # by time).
+            builds_by_type = util.multidict(
+                (build.name, build)
+                for build in builders)
+
+            # Create the chart items.
+            rows = []
+            for name,builds in util.sorted(builds_by_type.items()):
+                color = builder_colors.get(name, (0., 0., 0.))
+                hex_color = '%02x%02x%02x' % tuple(int(x*255)
+                                                   for x in color)
+                rows.append([])
+                for build in builds:
+                    elapsed = build.end_time - build.start_time
+                    width = max(1, int(pixels_per_minute * elapsed / 60))
+                    left = int(pixels_per_minute *
+                               (build.start_time - min_time) / 60)
+                    max_x = max(max_x, left + width)
+                    rows[-1].append(ChartItem(build, hex_color, left, width))
+            build_chart_data[slave] = rows
+
+        return { 'data' : build_chart_data,
+                 'max_x' : max_x }
@@ -0,0 +1,163 @@
+"""
+Stream of status updates for live dashboards.
+
+Translates the status changes into small events (builds starting and completing,
+and the dashboard summary of a builder changing), which are kept in a bounded
+history for the clients of the /ci/events stream.
+"""
+
+import collections
+import threading
+import time
+
+class StatusEvents(object):
+    """
+    StatusEvents object for publishing the status updates to the event stream
+    clients.
+
+    Events are (id, kind, data) tuples, where ids are of the form
+    '<epoch>-<number>', so clients of an earlier run can be told to reload.
+    """
+
+    # The number of events kept for clients to catch up with.
+    max_events = 1000
+
+    def __init__(self, status, format_time = str):
+        self.status = status
+        self.format_time = format_time
+        self.summary = None
+        self.epoch = '%x' % (int(time.time() * 1000),)
+
+        # The recent events, and the number of the last event.
+        self.events = collections.deque(maxlen = self.max_events)
+        self.last_number = 0
+
+        # The last summary data published for each builder.
+        self.summary_data = {}
+
+        # The wakers of the clients waiting for events.
+        self.lock = threading.Lock()
+        self.waiters = set()
+
+        self.status.add_listener(self.status_changed)
+
+    def build_todata(self, build):
+        if build is None:
+            return None
+        if build.end_time is None:
+            end_time_text = None
+        else:
+            end_time_text = self.format_time(build.end_time)
+        return { 'name' : build.name,
+                 'number' : build.number,
+                 'source_stamp' : build.source_stamp,
+                 'result' : build.result,
+                 'start_time' : build.start_time,
+                 'end_time' : build.end_time,
+                 'end_time_text' : end_time_text }
+
+    def summary_todata(self, name, info):
+        """
+        summary_todata(name, info) -> dict
+
+        Get the data for the summary of a builder (see
+        Summary.get_current_status()), as sent to the dashboard.
+        """
+
+        if info is None:
+            return { 'builder' : name }
+        return { 'builder' : name,
+                 'current' : [self.build_todata(b) for b in info['current']],
+                 'passing' : self.build_todata(info['passing']),
+                 'failing' : self.build_todata(info['failing']),
+                 'completed' : self.build_todata(info['completed']) }
+
+    def watch_summary(self, summary):
+        """
+        watch_summary(summary)
+
+        Publish the changes to the given dashboard summary.
+        """
+
+        with self.status.lock:
+            self.summary = summary
+            for name,info in summary.get_current_status().items():
+                self.summary_data[name] = self.summary_todata(name, info)
+            summary.add_listener(self.summary_changed)
+
+    def get_summary_data(self):
+        """
+        get_summary_data() -> dict
+
+        Get the current summary data of each builder.
+        """
+
+        with self.status.lock:
+            return dict(self.summary_data)
+
+    def get_last_id(self):
+        with self.lock:
+            return '%s-%d' % (self.epoch, self.last_number)
+
+    def publish(self, kind, data):
+        with self.lock:
+            self.last_number += 1
+            self.events.append(('%s-%d' % (self.epoch, self.last_number),
+                                kind, data))
+            for waker in self.waiters:
+                waker.wakeup()
+
+    def status_changed(self, change):
+        if change[0] != 'update_build':
+            return
+
+        data = change[1]
+        build = self.status.store.get_build(data['name'], data['number'])
+        if build is None:
+            return
+        if build.end_time is None:
+            self.publish('build_added', self.build_todata(build))
+        else:
+            self.publish('build_completed', self.build_todata(build))
+
+    def summary_changed(self, name):
+        # The summary is recomputed on any change to the builder, often without
+        # changing (or with equal builds), so compare the data we publish.
+        info = self.summary.get_current_status()[name]
+        data = self.summary_todata(name, info)
+        if data != self.summary_data.get(name):
+            self.summary_data[name] = data
+            self.publish('summary', data)
+
+    def get_events(self, last_id):
+        """
+        get_events(last_id) -> list or None
+
+        Get the events after the event with the given id, or None if the client
+        can't catch up (the id is from an earlier run, or too old).
+        """
+
+        with self.lock:
+            epoch,_,number = last_id.partition('-')
+            try:
+                number = int(number)
+            except ValueError:
+                return None
+            if epoch != self.epoch or number > self.last_number:
+                return None
+
+            # Check we still have all the events since last_id.
+            num_events = self.last_number - number
+            if num_events > len(self.events):
+                return None
+            if not num_events:
+                return []
+            return list(self.events)[-num_events:]
+
+    def add_waiter(self, waker):
+        with self.lock:
+            self.waiters.add(waker)
+
+    def remove_waiter(self, waker):
+        with self.lock:
+            self.waiters.discard(waker)
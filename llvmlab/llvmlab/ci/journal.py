@@ -0,0 +1,118 @@
+"""
+Write-ahead journal of changes to the CI status.
+"""
+
+import os
+import shutil
+
+from flask import json
+
+class StatusJournal(object):
+    """
+    StatusJournal object for appending status changes to a journal file, one
+    JSON record per line.
+
+    The journal records the changes since the last status snapshot. When a new
+    snapshot is taken, the journal is rotated so that the changes after the
+    snapshot go into a fresh file, and the rotated file is discarded once the
+    snapshot has been saved.
+    """
+
+    @staticmethod
+    def read_records(path):
+        """
+        read_records(path) -> iter
+
+        Read the complete records in a single journal file, yielding (change,
+        end offset) pairs. If we crashed in the middle of a write, the last
+        record may be incomplete, and it is ignored.
+        """
+
+        file = open(path)
+        try:
+            offset = 0
+            for line in file:
+                if not line.endswith('\n'):
+                    break
+                try:
+                    change = json.loads(line)
+                except ValueError:
+                    break
+                offset += len(line)
+                yield change, offset
+        finally:
+            file.close()
+
+    @staticmethod
+    def read(path):
+        """
+        read(path) -> iter
+
+        Read the changes recorded in the journal at the given path, and its
+        rotated journal (if any), oldest first.
+        """
+
+        for path in (path + '.old', path):
+            if not os.path.exists(path):
+                continue
+            for change,offset in StatusJournal.read_records(path):
+                yield change
+
+    def __init__(self, path):
+        self.path = path
+        self.rotated_path = path + '.old'
+
+        # Drop any incomplete record at the end of the files, so new records
+        # aren't appended after it (and then ignored by read()).
+        for path in (self.rotated_path, self.path):
+            if not os.path.exists(path):
+                continue
+            length = 0
+            for change,offset in self.read_records(path):
+                length = offset
+            if length != os.path.getsize(path):
+                file = open(path, 'r+b')
+                try:
+                    file.truncate(length)
+                finally:
+                    file.close()
+
+        self.file = open(self.path, 'a')
+
+    def append(self, change):
+        self.file.write(json.dumps(change) + '\n')
+        self.file.flush()
+
+    def rotate(self):
+        self.file.close()
+
+        # If the rotated journal is still there, the snapshot it was rotated
+        # for was never saved, so its changes are still needed. Add ours after
+        # them, rather than replacing them.
+        if os.path.exists(self.rotated_path):
+            rotated_file = open(self.rotated_path, 'a')
+            file = open(self.path)
+            try:
+                shutil.copyfileobj(file, rotated_file)
+            finally:
+                file.close()
+                rotated_file.close()
+            self.file = open(self.path, 'w')
+        else:
+            os.rename(self.path, self.rotated_path)
+            self.file = open(self.path, 'a')
+
+    def discard_rotated(self):
+        if os.path.exists(self.rotated_path):
+            os.remove(self.rotated_path)
+
+    def reset(self):
+        """
+        reset()
+
+        Discard all of the recorded changes, once they are in a snapshot.
+        """
+
+        self.discard_rotated()
+        self.file.close()
+        self.file = open(self.path, 'w')
@@ -0,0 +1,77 @@
+"""
+Reading and writing CI status snapshots (see Status.todata()).
+"""
+
+import gzip
+
+from flask import json
+
+# The snapshot formats, by name:
+#   json - pretty-printed JSON, for reading by humans,
+#   compact - JSON without any whitespace,
+#   gzip - compact JSON, compressed with gzip.
+formats = ('json', 'compact', 'gzip')
+
+# The magic number at the start of gzip files, used to detect the format.
+gzip_magic = '\x1f\x8b'
+
+def save(data, path, format = 'json'):
+    """
+    save(data, path, format = 'json')
+
+    Write the snapshot data to the given path, in the given format.
+    """
+
+    if format not in formats:
+        raise ValueError, "Unknown snapshot format: %r" % (format,)
+
+    # Encode the data up front, as the encoder makes many small writes, which
+    # are slow to compress.
+    if format == 'json':
+        text = json.dumps(data, indent=2) + '\n'
+    else:
+        text = json.dumps(data, separators=(',', ':'))
+
+    if format == 'gzip':
+        # Use a lower level than the default, which is much slower for little
+        # gain on JSON.
+        file = gzip.open(path, 'wb', 6)
+    else:
+        file = open(path, 'w')
+    try:
+        file.write(text)
+    finally:
+        file.close()
+
+def detect_format(path):
+    """
+    detect_format(path) -> str
+
+    Return the format of the snapshot at the given path, either 'gzip', or
+    'json' for any uncompressed snapshot.
+    """
+
+    file = open(path, 'rb')
+    try:
+        magic = file.read(len(gzip_magic))
+    finally:
+        file.close()
+    if magic == gzip_magic:
+        return 'gzip'
+    return 'json'
+
+def load(path):
+    """
+    load(path) -> data
+
+    Read the snapshot data at the given path, in any format.
+    """
+
+    if detect_format(path) == 'gzip':
+        file = gzip.open(path, 'rb')
+    else:
+        file = open(path, 'rb')
+    try:
+        return json.load(file)
+    finally:
+        file.close()
@@ -2,15 +2,46 @@
 Status information for the CI infrastructure, for use by the dashboard.
 """
 
+import atexit
+import itertools
+import Queue
 import threading
 import time
 import traceback
+import urllib
 import StringIO
 
 from llvmlab import util
+import llvmlab.ci.store
 import buildbot.statusclient
 
+# The table of interned names, see intern_name().
+interned_names = {}
+
+def intern_name(name):
+    """
+    intern_name(name) -> name
+
+    Return the shared copy of the given builder or slave name, which are
+    repeated across many builds.
+
+    The table is never pruned, so this is only for values from small, fixed
+    sets (not, for example, source stamps).
+    """
+
+    return interned_names.setdefault(name, name)
+
 class BuildStatus(util.simple_repr_mixin):
+    """
+    BuildStatus object for the status of a single build.
+
+    We keep a lot of these, so they use slots and share the builder and slave
+    names.
+    """
+
+    __slots__ = ('name', 'number', 'source_stamp', 'result', 'start_time',
+                 'end_time', 'slave')
+
     @staticmethod
     def fromdata(data):
         version = data['version']
@@ -37,21 +68,187 @@ class BuildStatus(util.simple_repr_mixin):
 
     def __init__(self, name, number, source_stamp,
                  result, start_time, end_time, slave):
-        self.name = name
+        self.name = intern_name(name)
         self.number = number
         self.source_stamp = source_stamp
         self.result = result
         self.start_time = start_time
         self.end_time = end_time
-        self.slave = slave
+        self.slave = intern_name(slave)
+
+class StatusCheckpointer(threading.Thread):
+    """
+    StatusCheckpointer object for saving the status in the background, at most
+    every save_interval seconds, or after every save_events events.
+    """
+
+    def __init__(self, app, status, save_interval = 60., save_events = 1000):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.app = app
+        self.status = status
+        self.save_interval = float(save_interval)
+        self.save_events = int(save_events)
+
+        # The number of events not reflected in the saved status.
+        self.unsaved_events = 0
+        self.last_save = time.time()
+        self.lock = threading.Lock()
+        self.waker = util.Waker()
+
+        # Serializes flushes, which may also come from the exit handler.
+        self.flush_lock = threading.Lock()
+
+        # Whether the checkpointer has been stopped, see stop().
+        self.stopped = False
+
+    def note_event(self):
+        """
+        note_event()
+
+        Note that an event has changed the status. This should be called with
+        the status lock held.
+        """
+
+        with self.lock:
+            self.unsaved_events += 1
+            unsaved_events = self.unsaved_events
+        if unsaved_events == 1 or unsaved_events >= self.save_events:
+            self.waker.wakeup()
+
+    def flush(self):
+        """
+        flush()
+
+        Save the status now, if there are any unsaved events.
+        """
+
+        with self.flush_lock:
+            # Take a snapshot of the status, then write it without holding the
+            # status lock. If we are journaling, the changes after the snapshot
+            # go into a new journal, and the old one can be discarded once the
+            # snapshot is saved.
+            with self.status.lock:
+                saved_events = self.unsaved_events
+                if not saved_events:
+                    return
+                self.status.archive_old_builds()
+                data = self.status.todata()
+                if self.status.journal is not None:
+                    self.status.journal.rotate()
+            self.app.save_status(data)
+            if self.status.journal is not None:
+                self.status.journal.discard_rotated()
+
+            with self.lock:
+                self.unsaved_events -= saved_events
+                self.last_save = time.time()
+
+    def stop(self):
+        """
+        stop()
+
+        Stop saving the status, in the background or at exit. Any unsaved events
+        are not saved (call flush() first to save them).
+        """
+
+        self.stopped = True
+        self.waker.wakeup()
+
+    def flush_at_exit(self):
+        if not self.stopped:
+            self.flush()
+
+    def run(self):
+        # Make sure we save on shutdown.
+        atexit.register(self.flush_at_exit)
+
+        while not self.stopped:
+            # Wait until the next save is due.
+            with self.lock:
+                unsaved_events = self.unsaved_events
+            if not unsaved_events:
+                self.waker.wait()
+                continue
+            if (unsaved_events < self.save_events and
+                time.time() < self.last_save + self.save_interval):
+                self.waker.wait(self.last_save + self.save_interval)
+                continue
+
+            try:
+                self.flush()
+            except:
+                # Log this failure.
+                os = StringIO.StringIO()
+                print >>os, "*** ERROR: failure in status checkpointer"
+                print >>os, "\n-- Traceback --"
+                traceback.print_exc(file = os)
+                self.app.logger.error(os.getvalue())
+
+                # Sleep for a while, then retry.
+                time.sleep(60)
+
+class StatusLoader(threading.Thread):
+    """
+    StatusLoader object for loading the builds deferred at startup in the
+    background (see Status.fromdata()).
+    """
 
-class StatusMonitor(threading.Thread):
     def __init__(self, app, status):
         threading.Thread.__init__(self)
         self.daemon = True
         self.app = app
         self.status = status
 
+    def run(self):
+        try:
+            start_time = time.time()
+            num_builds = self.status.load_all_pending_builds()
+            self.app.logger.info("loaded %d deferred builds in %.2fs" % (
+                    num_builds, time.time() - start_time))
+        except:
+            # Log this failure.
+            os = StringIO.StringIO()
+            print >>os, "*** ERROR: failure in status loader"
+            print >>os, "\n-- Traceback --"
+            traceback.print_exc(file = os)
+            self.app.logger.error(os.getvalue())
+
+class StatusMonitor(threading.Thread):
+    """
+    StatusMonitor object for applying the events from one buildbot master to
+    the status.
+
+    Each master is monitored by its own thread, and builds are fetched without
+    holding the status lock, so a slow or failing master doesn't hold up the
+    others. The builders of a named master appear in the status with the master
+    name as a prefix (see Status.get_builder_name()).
+    """
+
+    def __init__(self, app, status, statusclient = None, master = None,
+                 checkpointer = None):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.app = app
+        self.status = status
+        if statusclient is None:
+            statusclient = status.statusclient
+        self.statusclient = statusclient
+        self.master = master
+
+        # The queue of status packets pushed by the master.
+        self.push_queue = Queue.Queue()
+
+        # The waker used to wake up the monitor when it is waiting for the next
+        # poll.
+        self.waker = util.Waker()
+
+        # The checkpointer which saves the status (shared by the monitors of
+        # all the masters).
+        if checkpointer is None:
+            checkpointer = StatusCheckpointer(app, status)
+        self.checkpointer = checkpointer
+
     def run(self):
         while 1:
             try:
@@ -59,7 +256,8 @@ class StatusMonitor(threading.Thread):
             except:
                 # Log this failure.
                 os = StringIO.StringIO()
-                print >>os, "*** ERROR: failure in buildbot monitor"
+                print >>os, "*** ERROR: failure in buildbot monitor (%s)" % (
+                    self.statusclient.master_url,)
                 print >>os, "\n-- Traceback --"
                 traceback.print_exc(file = os)
                 self.app.logger.error(os.getvalue())
@@ -67,81 +265,123 @@ class StatusMonitor(threading.Thread):
                 # Sleep for a while, then restart.
                 time.sleep(60)
 
-    def read_events(self):
-        # Constantly read events from the status client.
+    def push_packets(self, packets):
+        """
+        push_packets(packets)
+
+        Queue status packets pushed by the buildbot master (see
+        StatusClient.push_packet()) for processing on the monitor thread.
+        """
+
+        self.push_queue.put(packets)
+        self.waker.wakeup()
+
+    def get_pushed_events(self):
         while 1:
-            for event in self.status.statusclient.pull_events():
-                # Log the event (for debugging).
-                self.status.event_log.append((time.time(), event))
-                self.status.event_log = self.status.event_log[-100:]
-
-                kind = event[0]
-                if kind == 'added_builder':
-                    name = event[1]
-                    if name not in self.status.builders:
-                        self.status.builders[name] = []
-                        self.status.build_map[name] = {}
-                elif kind == 'removed_builder':
-                    name = event[1]
-                    if name in self.status.builders:
-                        self.status.builders.pop(name)
-                        self.status.build_map.pop(name)
-                elif kind == 'reset_builder':
-                    name = event[1]
-                    self.status.builders[name] = []
-                    self.status.build_map[name] = {}
-                elif kind == 'invalid_build':
-                    _,name,id = event
-                    build = self.status.build_map[name].get(id)
-                    if build is not None:
-                        self.status.builders[name].remove(build)
-                        self.status.build_map[name].pop(id)
-                elif kind in ('add_build', 'completed_build'):
-                    _,name,id = event
-                    build = self.status.build_map[name].get(id)
-                    add_build = False
-                    if build is None:
-                        add_build = True
-                        build = BuildStatus(name, id, None, None, None, None,
-                                            None)
-
-                    # Get the build information.
+            try:
+                packets = self.push_queue.get_nowait()
+            except Queue.Empty:
+                break
+            for packet in packets:
+                # Skip any bad packet, rather than failing the whole sweep.
+                events = self.statusclient.push_packet(packet)
+                while 1:
                     try:
-                        res = self.status.statusclient.get_json_result((
-                                'builders', name, 'builds', str(build.number)))
+                        event = events.next()
+                    except StopIteration:
+                        break
                     except:
-                        res = None
-
-                    if res:
-                        build.result = res['results']
-                        if 'sourceStamps' in res:
-                            build.source_stamp = res['sourceStamps'][0]['revision']
-                        else:
-                            build.source_stamp = res['sourceStamp']['revision']
-                        build.start_time = res['times'][0]
-                        build.end_time = res['times'][1]
-                        build.slave = res['slave']
-
-                        if add_build:
-                            # Add to the builds list, maintaining order.
-                            self.status.build_map[name][id] = build
-                            builds = self.status.builders[name]
-                            builds.append(build)
-                            if (len(builds) > 1 and
-                                build.number < builds[-2].number):
-                                builds.sort(key = lambda b: b.number)
-                else:
-                    self.app.logger.warning("unknown event '%r'" % (event,))
-
-                # FIXME: Don't save this frequently, we really just want to
-                # checkpoint and make sure we save on restart.
-                self.app.save_status()
-
-            time.sleep(.1)
-        
+                        os = StringIO.StringIO()
+                        print >>os, "*** ERROR: bad status packet (%s)" % (
+                            self.statusclient.master_url,)
+                        print >>os, "\n-- Traceback --"
+                        traceback.print_exc(file = os)
+                        self.app.logger.error(os.getvalue())
+                        break
+                    yield event
+
+    def read_events(self):
+        # Constantly read events from the status client, whether pushed by the
+        # master or polled.
+        while 1:
+            for event in itertools.chain(
+                    self.get_pushed_events(),
+                    self.statusclient.pull_events()):
+                # Translate the event before taking the lock, as this may need
+                # to fetch the build from the master.
+                changes = self.get_event_changes(event)
+                with self.status.lock:
+                    self.log_event(event)
+                    for change in changes:
+                        self.status.apply_change(change)
+                    self.checkpointer.note_event()
+
+            # Sleep until the next poll is due.
+            self.waker.wait(self.statusclient.get_next_poll_time())
+
+    def log_event(self, event):
+        # Log the event (for debugging).
+        if self.master is not None:
+            event = (self.master,) + tuple(event)
+        self.status.event_log.append((time.time(), event))
+        self.status.event_log = self.status.event_log[-100:]
+
+    def get_event_changes(self, event):
+        """
+        get_event_changes(event) -> list
+
+        Translate an event from the status client into changes to the status.
+        """
+
+        kind = event[0]
+        if kind in ('added_builder', 'removed_builder', 'reset_builder',
+                    'invalid_build', 'add_build', 'completed_build'):
+            name = self.status.get_builder_name(self.master, event[1])
+        if kind == 'added_builder':
+            return [('add_builder', name)]
+        elif kind == 'removed_builder':
+            return [('remove_builder', name)]
+        elif kind == 'reset_builder':
+            return [('reset_builder', name)]
+        elif kind == 'invalid_build':
+            _,_,id = event
+            return [('remove_build', name, id)]
+        elif kind in ('add_build', 'completed_build'):
+            _,builder_name,id = event
+
+            # Get the build information (usually already downloaded by the
+            # status client).
+            try:
+                res = self.statusclient.get_build(builder_name, id)
+            except:
+                res = None
+
+            if not res:
+                return []
+            if 'sourceStamps' in res:
+                source_stamp = res['sourceStamps'][0]['revision']
+            else:
+                source_stamp = res['sourceStamp']['revision']
+            build = BuildStatus(name, id, source_stamp, res['results'],
+                                res['times'][0], res['times'][1],
+                                res['slave'])
+            return [('update_build', build.todata())]
+        else:
+            self.app.logger.warning("unknown event '%r'" % (event,))
+            return []
+
 class Status(util.simple_repr_mixin):
     @staticmethod
-    def fromdata(data):
+    def fromdata(data, store = None, recent_builds = None):
+        """
+        fromdata(data, store = None, recent_builds = None) -> Status
+
+        Create the status from its saved data. If recent_builds is given (and
+        the builds are kept in memory), only that many of the most recent builds
+        of each builder are loaded, and the rest are left pending until
+        load_pending_builds() is called.
+        """
+
         version = data['version']
         if version != 0:
             raise ValueError, "Unknown version"
@@ -149,37 +389,389 @@ class Status(util.simple_repr_mixin):
         sc = data.get('statusclient')
         if sc:
             sc = buildbot.statusclient.StatusClient.fromdata(sc)
-        return Status(data['master_url'],
-                      dict((name, [BuildStatus.fromdata(b)
-                                   for b in builds])
-                           for name,builds in data['builders']),
-                      sc)
+        masters = dict((name, buildbot.statusclient.StatusClient.fromdata(item))
+                       for name,item in data.get('masters', {}).items())
+
+        builders = {}
+        pending_builds = {}
+        for name,builds in data['builders']:
+            if (store is None and recent_builds is not None and
+                len(builds) > recent_builds):
+                split = len(builds) - recent_builds
+                pending_builds[name] = builds[:split]
+                builds = builds[split:]
+            builders[name] = [BuildStatus.fromdata(b)
+                              for b in builds]
+
+        status = Status(data['master_url'], builders, sc, store, masters)
+        status.pending_builds = pending_builds
+        return status
 
     def todata(self):
+        if self.statusclient is None:
+            statusclient = None
+        else:
+            statusclient = self.statusclient.todata()
+        builders = [(name, self.pending_builds.get(name, []) + builds)
+                    for name,builds in self.store.todata()]
         return { 'version' : 0,
                  'master_url' : self.master_url,
-                 'builders' : [(name, [b.todata()
-                                       for b in builds])
-                               for name,builds in self.builders.items()],
-                 'statusclient' : self.statusclient.todata() }
+                 'builders' : builders,
+                 'statusclient' : statusclient,
+                 'masters' : dict((name, sc.todata())
+                                  for name,sc in self.masters.items()) }
 
-    def __init__(self, master_url, builders, statusclient = None):
+    def __init__(self, master_url, builders, statusclient = None,
+                 store = None, masters = None):
         self.master_url = master_url
-        self.builders = builders
         if statusclient is None and master_url:
             statusclient = buildbot.statusclient.StatusClient(master_url)
         self.statusclient = statusclient
 
+        # The status clients for the additional masters whose builders are
+        # merged into the status, by master name (see get_builder_name()).
+        if masters is None:
+            masters = {}
+        self.masters = dict(masters)
+
+        # Set up the build storage. If we were given a store, import any builds
+        # for builders it doesn't have yet.
+        if store is None:
+            store = llvmlab.ci.store.MemoryBuildStore(builders)
+        else:
+            for name,builds in builders.items():
+                if name not in store.builders:
+                    store.add_builder(name)
+                    for build in builds:
+                        store.update_build(build)
+        self.store = store
+
         # Transient data.
+        self.lock = threading.RLock()
         self.event_log = []
-        self.build_map = dict((name, dict((b.number, b)
-                                          for b in builds))
-                              for name,builds in self.builders.items())
+
+        # The journal changes are recorded to, if any.
+        self.journal = None
+
+        # Map of builder name to the data of its older builds, not yet loaded
+        # into the store (see fromdata()).
+        self.pending_builds = {}
+
+        # The number of builds to keep per builder, and the archive older builds
+        # are moved to, if any.
+        self.hot_builds = None
+        self.archive = None
+
+        # The functions to call with each change, once it has been applied.
+        self.listeners = []
+
+        # The monitor for each master, once started (see start_monitor()),
+        # with the main master under None.
+        self.monitors = {}
+
+        # The generation of the status, which is increased on every change, and
+        # the epoch which distinguishes the generations of this Status instance
+        # from those of earlier runs.
+        self.generation = 0
+        self.epoch = '%x' % (int(time.time() * 1000),)
+
+    @property
+    def builders(self):
+        return self.store.builders
+
+    @property
+    def build_map(self):
+        return self.store.build_map
+
+    def get_builder_names(self):
+        return self.store.get_builder_names()
+
+    def set_masters(self, masters):
+        """
+        set_masters(masters)
+
+        Set the additional masters to monitor, from a dictionary of master name
+        to URL. The clients for masters we already know are kept.
+        """
+
+        for name,url in masters.items():
+            sc = self.masters.get(name)
+            if sc is None or sc.master_url != url:
+                self.masters[name] = buildbot.statusclient.StatusClient(url)
+        for name in list(self.masters):
+            if name not in masters:
+                del self.masters[name]
+
+    def get_status_clients(self):
+        """
+        get_status_clients() -> list
+
+        Return the (master name, status client) pairs for the monitored
+        masters, with the main master (if any) first, under None.
+        """
+
+        clients = []
+        if self.statusclient is not None:
+            clients.append((None, self.statusclient))
+        clients.extend(util.sorted(self.masters.items()))
+        return clients
+
+    def get_builder_name(self, master, name):
+        """
+        get_builder_name(master, name) -> str
+
+        Return the name in the status of the given builder of the given master
+        (or of the main master, if None).
+        """
+
+        if master is None:
+            return name
+        return '%s/%s' % (master, name)
+
+    def split_builder_name(self, name):
+        """
+        split_builder_name(name) -> (master, name)
+
+        Return the master and master builder name of the given status builder.
+        """
+
+        for master in self.masters:
+            prefix = master + '/'
+            if name.startswith(prefix):
+                return (master, name[len(prefix):])
+        return (None, name)
+
+    def get_builder_url(self, name):
+        """
+        get_builder_url(name) -> str
+
+        Return the URL of the given builder's page on its buildbot master.
+        """
+
+        master,builder_name = self.split_builder_name(name)
+        if master is None:
+            master_url = self.master_url
+        else:
+            master_url = self.masters[master].master_url
+        return '%s/builders/%s' % ((master_url or '').rstrip('/'),
+                                   urllib.quote(builder_name))
+
+    def get_etag(self):
+        """
+        get_etag() -> str
+
+        Return a tag for the current generation of the status, which changes
+        whenever the status changes.
+        """
+
+        return '%s-%d' % (self.epoch, self.generation)
+
+    def find_builds(self, names = None, source_stamp = None, slave = None,
+                    min_start_time = None, completed = None):
+        """
+        find_builds(names = None, source_stamp = None, slave = None,
+                    min_start_time = None, completed = None) -> list
+
+        Return the builds matching the given filters, see
+        BuildStore.find_builds().
+        """
+
+        return self.store.find_builds(names, source_stamp, slave,
+                                      min_start_time, completed)
+
+    def add_listener(self, listener):
+        """
+        add_listener(listener)
+
+        Call listener(change) after each change is applied to the status. The
+        listener is called with the status lock held.
+        """
+
+        with self.lock:
+            self.listeners.append(listener)
+
+    def apply_change(self, change):
+        """
+        apply_change(change)
+
+        Apply a change to the status, record it in the journal (if any), and
+        notify the listeners.
+        Changes are tuples of one of the forms:
+
+          ('add_builder', name)
+          ('remove_builder', name)
+          ('reset_builder', name)
+          ('remove_build', name, number)
+          ('archive_builds', name, number)
+          ('update_build', build data)
+
+        where 'archive_builds' removes the builds older than the given number,
+        once they have been written to the archive.
+
+        Applying a change more than once has no additional effect.
+
+        The listeners are also called with ('load_builds', name, numbers) when
+        pending builds are loaded, which is not a change to the status and is
+        not journaled.
+        """
+
+        # Load any pending builds of the builder first, so the change applies to
+        # its full history.
+        kind = change[0]
+        if kind == 'update_build':
+            name = change[1]['name']
+        else:
+            name = change[1]
+        if name in self.pending_builds:
+            self.load_pending_builds(name)
+
+        if kind == 'add_builder':
+            self.store.add_builder(change[1])
+        elif kind == 'remove_builder':
+            self.store.remove_builder(change[1])
+        elif kind == 'reset_builder':
+            self.store.reset_builder(change[1])
+        elif kind == 'remove_build':
+            _,name,number = change
+            self.store.remove_build(name, number)
+        elif kind == 'archive_builds':
+            _,name,number = change
+            self.store.remove_builds_before(name, number)
+        elif kind == 'update_build':
+            self.store.update_build(BuildStatus.fromdata(change[1]))
+        else:
+            raise ValueError, "Unknown change: %r" % (change,)
+
+        if self.journal is not None:
+            self.journal.append(change)
+
+        self.generation += 1
+        for listener in self.listeners:
+            listener(change)
+
+    def load_pending_builds(self, name):
+        """
+        load_pending_builds(name) -> int
+
+        Load the pending builds of the given builder into the store, and return
+        the number of builds loaded.
+        """
+
+        with self.lock:
+            data = self.pending_builds.pop(name, None)
+            if not data:
+                return 0
+
+            builds = [BuildStatus.fromdata(b)
+                      for b in data]
+            self.store.load_builds(name, builds)
+            self.generation += 1
+
+            change = ('load_builds', name, [b.number for b in builds])
+            for listener in self.listeners:
+                listener(change)
+            return len(builds)
+
+    def load_all_pending_builds(self):
+        """
+        load_all_pending_builds() -> int
+
+        Load all the pending builds, one builder at a time (so readers are only
+        briefly blocked), and return the number of builds loaded.
+        """
+
+        num_builds = 0
+        for name in list(self.pending_builds):
+            num_builds += self.load_pending_builds(name)
+        return num_builds
+
+    def archive_old_builds(self):
+        """
+        archive_old_builds()
+
+        Move the builds beyond the most recent hot_builds builds of each builder
+        to the archive, except that the last passing build (and any after it)
+        is always kept, as the summary needs it. This should be called with the
+        status lock held.
+        """
+
+        if self.archive is None or self.hot_builds is None:
+            return
+
+        for name in self.get_builder_names():
+            # Wait until the older builds are loaded.
+            if name in self.pending_builds:
+                continue
+
+            builds = self.builders[name]
+            if len(builds) <= self.hot_builds:
+                continue
+
+            # Keep the last passing build.
+            num_archived = len(builds) - self.hot_builds
+            for i in range(len(builds) - 1, -1, -1):
+                build = builds[i]
+                if build.start_time is not None and build.end_time is None:
+                    continue
+                if build.result == 0:
+                    num_archived = min(num_archived, i)
+                    break
+            if not num_archived:
+                continue
+
+            # Write the builds to the archive before removing them, so they are
+            # never lost.
+            self.archive.append(builds[:num_archived])
+            self.apply_change(('archive_builds', name,
+                               builds[num_archived].number))
 
     def start_monitor(self, app):
-        if self.statusclient:
-            self.statusclient.logger = app.logger
+        """
+        start_monitor(app) -> StatusMonitor
+
+        Start monitoring the masters, each on its own thread, and return the
+        monitor of the main master (or of the first master, if there is no main
+        master).
+        """
+
+        clients = self.get_status_clients()
+        if not clients:
+            return None
+
+        checkpointer = StatusCheckpointer(app, self)
+        checkpointer.save_interval = app.config.get(
+            'STATUS_SAVE_INTERVAL', checkpointer.save_interval)
+        checkpointer.save_events = app.config.get(
+            'STATUS_SAVE_EVENTS', checkpointer.save_events)
+
+        # Each master has its own poll workers and connections, which can be
+        # set per master in STATUS_MASTERS.
+        masters_config = app.config.get('STATUS_MASTERS') or {}
+        for master,sc in clients:
+            options = masters_config.get(master)
+            if not isinstance(options, dict):
+                options = {}
+
+            sc.logger = app.logger
+            sc.set_pool_size(
+                options.get('poll_workers',
+                            app.config.get('STATUS_POLL_WORKERS',
+                                           sc.pool_size)),
+                options.get('poll_connections',
+                            app.config.get('STATUS_POLL_CONNECTIONS')))
+            sc.response_cache.max_entries = app.config.get(
+                'STATUS_RESPONSE_CACHE_SIZE', sc.response_cache.max_entries)
+
+            # If the master pushes status updates to us, polling is only needed
+            # to reconcile any updates we missed.
+            if app.config.get('STATUS_PUSH_ENABLED'):
+                sc.reconcile_poll_rate = app.config.get(
+                    'STATUS_RECONCILE_POLL_RATE', 300.)
+
+            self.monitors[master] = StatusMonitor(app, self, sc, master,
+                                                  checkpointer)
 
-            monitor = StatusMonitor(app, self)
-            monitor.start()
-            return monitor
+        checkpointer.start()
+        for master,_ in clients:
+            self.monitors[master].start()
+        return self.monitors[clients[0][0]]
@@ -0,0 +1,462 @@
+"""
+Storage backends for the builds tracked in the CI status.
+"""
+
+import sqlite3
+import threading
+
+from llvmlab import util
+
+class BuildStore(object):
+    """
+    BuildStore object defining the interface to the storage for the builds of
+    each builder.
+
+    Builds are stored as BuildStatus objects. The builds of a builder are kept
+    ordered by build number.
+    """
+
+    # Mapping interfaces to the stored builds, of builder name to list of builds
+    # and of builder name to dictionary of build number to build.
+    builders = None
+    build_map = None
+
+    def todata(self):
+        """
+        todata() -> list
+
+        Return the builds to record in a status snapshot, as a list of (builder
+        name, [build data]) pairs.
+        """
+        raise NotImplementedError
+
+    def get_builder_names(self):
+        raise NotImplementedError
+
+    def get_build(self, name, number):
+        raise NotImplementedError
+
+    def add_builder(self, name):
+        raise NotImplementedError
+
+    def remove_builder(self, name):
+        raise NotImplementedError
+
+    def reset_builder(self, name):
+        raise NotImplementedError
+
+    def remove_build(self, name, number):
+        raise NotImplementedError
+
+    def remove_builds_before(self, name, number):
+        """
+        remove_builds_before(name, number)
+
+        Remove the builds of the given builder older than the given build
+        number.
+        """
+        raise NotImplementedError
+
+    def update_build(self, build):
+        """
+        update_build(build)
+
+        Add the given build, or update the stored build with the same builder
+        and number.
+        """
+        raise NotImplementedError
+
+    def load_builds(self, name, builds):
+        """
+        load_builds(name, builds)
+
+        Add the given builds of the given builder, ordered by build number. This
+        is used to load older builds in bulk.
+        """
+        for build in builds:
+            self.update_build(build)
+
+    def find_builds(self, names = None, source_stamp = None, slave = None,
+                    min_start_time = None, completed = None):
+        """
+        find_builds(names = None, source_stamp = None, slave = None,
+                    min_start_time = None, completed = None) -> list
+
+        Return the builds matching all of the given filters, grouped by builder
+        and ordered by build number. The filters are:
+
+          names - only builds of the given builders,
+          source_stamp - only builds of the given source stamp,
+          slave - only builds run on the given slave,
+          min_start_time - only builds started after the given time,
+          completed - only completed (or active, if False) builds.
+        """
+        raise NotImplementedError
+
+class MemoryBuildStore(BuildStore):
+    """
+    MemoryBuildStore object for keeping all builds in memory.
+
+    Builds are also indexed by (builder name, source stamp), so that the builds
+    of a revision can be found without scanning the builder's history.
+
+    The stored data is copy-on-write: the builds of a builder are a tuple, and
+    changes build new tuples, dictionaries and BuildStatus objects which are
+    swapped in with a single assignment. Readers don't need to take the status
+    lock, and never see a partially applied change (though consecutive reads may
+    see different versions). Changes must be made with the status lock held.
+    """
+
+    def __init__(self, builders = {}):
+        self.builders = dict((name, tuple(builds))
+                             for name,builds in builders.items())
+        self.build_map = dict((name, dict((b.number, b)
+                                          for b in builds))
+                              for name,builds in self.builders.items())
+        self.source_stamp_map = {}
+        for builds in self.builders.values():
+            for build in builds:
+                self.index_build(build)
+
+    def index_build(self, build):
+        key = (build.name, build.source_stamp)
+        builds = self.source_stamp_map.get(key, ())
+
+        # Maintain build number order.
+        builds = builds + (build,)
+        if len(builds) > 1 and build.number < builds[-2].number:
+            builds = tuple(sorted(builds, key = lambda b: b.number))
+        self.source_stamp_map[key] = builds
+
+    def unindex_build(self, build):
+        key = (build.name, build.source_stamp)
+        builds = tuple(b for b in self.source_stamp_map[key]
+                       if b is not build)
+        if builds:
+            self.source_stamp_map[key] = builds
+        else:
+            del self.source_stamp_map[key]
+
+    def unindex_builder(self, name):
+        for build in self.builders.get(name, ()):
+            self.unindex_build(build)
+
+    def set_builds(self, name, builds, build_map):
+        # Swap in the new builds of a builder, keeping the builder dictionaries
+        # themselves unchanged if the builder already exists.
+        if name in self.builders:
+            self.builders[name] = builds
+            self.build_map[name] = build_map
+        else:
+            self.builders = dict(self.builders)
+            self.builders[name] = builds
+            self.build_map = dict(self.build_map)
+            self.build_map[name] = build_map
+
+    def todata(self):
+        return [(name, [b.todata()
+                        for b in builds])
+                for name,builds in self.builders.items()]
+
+    def get_builder_names(self):
+        return self.builders.keys()
+
+    def get_build(self, name, number):
+        return self.build_map.get(name, {}).get(number)
+
+    def add_builder(self, name):
+        if name not in self.builders:
+            self.set_builds(name, (), {})
+
+    def remove_builder(self, name):
+        if name in self.builders:
+            self.unindex_builder(name)
+            builders = dict(self.builders)
+            builders.pop(name)
+            build_map = dict(self.build_map)
+            build_map.pop(name)
+            self.builders = builders
+            self.build_map = build_map
+
+    def reset_builder(self, name):
+        self.unindex_builder(name)
+        self.set_builds(name, (), {})
+
+    def remove_build(self, name, number):
+        build = self.get_build(name, number)
+        if build is not None:
+            self.unindex_build(build)
+            build_map = dict(self.build_map[name])
+            build_map.pop(number)
+            self.set_builds(name, tuple(b for b in self.builders[name]
+                                        if b is not build),
+                            build_map)
+
+    def remove_builds_before(self, name, number):
+        builds = self.builders.get(name)
+        if not builds or builds[0].number >= number:
+            return
+
+        index = 0
+        build_map = dict(self.build_map[name])
+        while index != len(builds) and builds[index].number < number:
+            build = builds[index]
+            self.unindex_build(build)
+            build_map.pop(build.number)
+            index += 1
+        self.set_builds(name, builds[index:], build_map)
+
+    def load_builds(self, name, builds):
+        self.add_builder(name)
+        existing = self.builders[name]
+        if not builds or (existing and
+                          builds[-1].number >= existing[0].number):
+            BuildStore.load_builds(self, name, builds)
+            return
+
+        # The builds are all older than the ones we have, so just prepend them.
+        build_map = dict(self.build_map[name])
+        for build in builds:
+            build_map[build.number] = build
+            self.index_build(build)
+        self.set_builds(name, tuple(builds) + existing, build_map)
+
+    def update_build(self, build):
+        name = build.name
+        self.add_builder(name)
+
+        # Replace any existing build, rather than updating it in place.
+        builds = self.builders[name]
+        existing = self.build_map[name].get(build.number)
+        if existing is not None:
+            self.unindex_build(existing)
+            builds = tuple((b, build)[b is existing]
+                           for b in builds)
+        else:
+            # Add to the builds, maintaining order.
+            builds = builds + (build,)
+            if len(builds) > 1 and build.number < builds[-2].number:
+                builds = tuple(sorted(builds, key = lambda b: b.number))
+        self.index_build(build)
+
+        build_map = dict(self.build_map[name])
+        build_map[build.number] = build
+        self.set_builds(name, builds, build_map)
+
+    def find_builds(self, names = None, source_stamp = None, slave = None,
+                    min_start_time = None, completed = None):
+        # Take a single version of the builds, so we don't see changes made
+        # while we search.
+        builders = self.builders
+        source_stamp_map = self.source_stamp_map
+        if names is None:
+            names = builders.keys()
+
+        results = []
+        for name in names:
+            # Use the source stamp index, if we can.
+            if source_stamp is not None:
+                builds = source_stamp_map.get((name, source_stamp), ())
+            else:
+                builds = builders.get(name, ())
+
+            for build in builds:
+                if (source_stamp is not None and
+                    build.source_stamp != source_stamp):
+                    continue
+                if slave is not None and build.slave != slave:
+                    continue
+                if (min_start_time is not None and
+                    (build.start_time is None or
+                     build.start_time <= min_start_time)):
+                    continue
+                if (completed is not None and
+                    completed != (build.end_time is not None)):
+                    continue
+                results.append(build)
+        return results
+
+###
+
+class SQLiteBuildersView(object):
+    """
+    Read-only mapping of builder name to the list of builds, for a SQLite store.
+    """
+
+    def __init__(self, store):
+        self.store = store
+
+    def __contains__(self, name):
+        return self.store.has_builder(name)
+    def __getitem__(self, name):
+        if not self.store.has_builder(name):
+            raise KeyError, name
+        return self.store.find_builds(names = [name])
+    def __iter__(self):
+        return iter(self.store.get_builder_names())
+    def __len__(self):
+        return len(self.store.get_builder_names())
+    def get(self, name, default = None):
+        if not self.store.has_builder(name):
+            return default
+        return self[name]
+    def keys(self):
+        return self.store.get_builder_names()
+    def items(self):
+        builds = util.multidict((build.name, build)
+                                for build in self.store.find_builds())
+        return [(name, builds.get(name, []))
+                for name in self.store.get_builder_names()]
+    def values(self):
+        return [builds for _,builds in self.items()]
+
+class SQLiteBuildMapView(SQLiteBuildersView):
+    """
+    Read-only mapping of builder name to the dictionary of builds by number, for
+    a SQLite store.
+    """
+
+    def __getitem__(self, name):
+        return dict((build.number, build)
+                    for build in SQLiteBuildersView.__getitem__(self, name))
+    def items(self):
+        return [(name, dict((build.number, build)
+                            for build in builds))
+                for name,builds in SQLiteBuildersView.items(self)]
+
+class SQLiteBuildStore(BuildStore):
+    """
+    SQLiteBuildStore object for keeping the builds in a SQLite database, which
+    is indexed for the queries made by the dashboard.
+    """
+
+    schema = """
+CREATE TABLE IF NOT EXISTS builders (
+    name TEXT PRIMARY KEY);
+CREATE TABLE IF NOT EXISTS builds (
+    builder TEXT NOT NULL,
+    number INTEGER NOT NULL,
+    source_stamp TEXT,
+    result INTEGER,
+    start_time REAL,
+    end_time REAL,
+    slave TEXT,
+    PRIMARY KEY (builder, number));
+CREATE INDEX IF NOT EXISTS builds_source_stamp ON builds (source_stamp, builder);
+CREATE INDEX IF NOT EXISTS builds_slave ON builds (slave);
+CREATE INDEX IF NOT EXISTS builds_start_time ON builds (start_time);
+"""
+
+    build_columns = ('builder, number, source_stamp, result, start_time, '
+                     'end_time, slave')
+
+    def __init__(self, path):
+        self.path = path
+
+        # The connection is shared by the monitor and request threads, guarded
+        # by our lock.
+        self.lock = threading.RLock()
+        self.connection = sqlite3.connect(path, check_same_thread = False)
+        self.connection.execute("PRAGMA journal_mode = WAL")
+        self.connection.execute("PRAGMA synchronous = NORMAL")
+        self.connection.executescript(self.schema)
+        self.connection.commit()
+
+        self.builders = SQLiteBuildersView(self)
+        self.build_map = SQLiteBuildMapView(self)
+
+    def todata(self):
+        # The builds are saved in the database, not the snapshot.
+        return []
+
+    def make_build(self, row):
+        # Import here, to avoid a circular import.
+        from llvmlab.ci.status import BuildStatus
+        return BuildStatus(*row)
+
+    def execute(self, query, args = ()):
+        with self.lock:
+            return self.connection.execute(query, args).fetchall()
+
+    def modify(self, *statements):
+        with self.lock:
+            for query,args in statements:
+                self.connection.execute(query, args)
+            self.connection.commit()
+
+    def has_builder(self, name):
+        return bool(self.execute("SELECT 1 FROM builders WHERE name = ?",
+                                 (name,)))
+
+    def get_builder_names(self):
+        return [name for name, in self.execute(
+                "SELECT name FROM builders ORDER BY name")]
+
+    def get_build(self, name, number):
+        rows = self.execute(("SELECT %s FROM builds WHERE builder = ? AND "
+                             "number = ?") % self.build_columns, (name, number))
+        if not rows:
+            return None
+        return self.make_build(rows[0])
+
+    def add_builder(self, name):
+        self.modify(("INSERT OR IGNORE INTO builders (name) VALUES (?)",
+                     (name,)))
+
+    def remove_builder(self, name):
+        self.modify(("DELETE FROM builds WHERE builder = ?", (name,)),
+                    ("DELETE FROM builders WHERE name = ?", (name,)))
+
+    def reset_builder(self, name):
+        self.modify(("DELETE FROM builds WHERE builder = ?", (name,)),
+                    ("INSERT OR IGNORE INTO builders (name) VALUES (?)",
+                     (name,)))
+
+    def remove_build(self, name, number):
+        self.modify(("DELETE FROM builds WHERE builder = ? AND number = ?",
+                     (name, number)))
+
+    def remove_builds_before(self, name, number):
+        self.modify(("DELETE FROM builds WHERE builder = ? AND number < ?",
+                     (name, number)))
+
+    def update_build(self, build):
+        self.modify(("INSERT OR IGNORE INTO builders (name) VALUES (?)",
+                     (build.name,)),
+                    ("INSERT OR REPLACE INTO builds (%s) VALUES "
+                     "(?, ?, ?, ?, ?, ?, ?)" % self.build_columns,
+                     (build.name, build.number, build.source_stamp,
+                      build.result, build.start_time, build.end_time,
+                      build.slave)))
+
+    def find_builds(self, names = None, source_stamp = None, slave = None,
+                    min_start_time = None, completed = None):
+        conditions = []
+        args = []
+        if names is not None:
+            names = list(names)
+            if not names:
+                return []
+            conditions.append("builder IN (%s)" % ", ".join("?" for n in names))
+            args.extend(names)
+        if source_stamp is not None:
+            conditions.append("source_stamp = ?")
+            args.append(source_stamp)
+        if slave is not None:
+            conditions.append("slave = ?")
+            args.append(slave)
+        if min_start_time is not None:
+            conditions.append("start_time > ?")
+            args.append(min_start_time)
+        if completed is not None:
+            if completed:
+                conditions.append("end_time IS NOT NULL")
+            else:
+                conditions.append("end_time IS NULL")
+
+        query = "SELECT %s FROM builds" % self.build_columns
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY builder, number"
+        return [self.make_build(row)
+                for row in self.execute(query, args)]
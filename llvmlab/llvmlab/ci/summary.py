@@ -8,56 +8,173 @@ current high-level status.
 import sys
 
 class Summary(object):
+    """
+    Summary object for tracking the current status of each configured builder.
+
+    The summary is computed once from the full build history, then kept up to
+    date from the status changes. The common changes (a new build starting, or
+    the newest active build completing) are applied in constant time; anything
+    else causes the affected builder to be rescanned.
+    """
+
     def __init__(self, config, status):
         self.config = config
         self.status = status
 
+        # The summary for each configured builder. Entries are replaced, never
+        # modified, so readers don't need to take the status lock.
+        self.info = {}
+
+        # The functions to call with the name of each builder whose summary has
+        # been updated.
+        self.listeners = []
+
+        with self.status.lock:
+            for builder in self.config.builders:
+                self.info[builder.name] = self.compute_builder_status(
+                    builder.name)
+            self.status.add_listener(self.status_changed)
+
+    def add_listener(self, listener):
+        """
+        add_listener(listener)
+
+        Call listener(name) after the summary of a builder is updated. The
+        listener is called with the status lock held.
+        """
+
+        with self.status.lock:
+            self.listeners.append(listener)
+
     def get_current_status(self):
         """
-        get_current_status() -> ...
+        get_current_status() -> dict
 
-        Compute information on the current status.
+        Return the current status of each configured builder, as a dictionary
+        of:
+          current - the current build(s), most recent first,
+          passing - the last passing build,
+          failing - the oldest failing build since the last passing build,
+          completed - the last completed build.
         """
 
-        # For each configured builder, compute the:
-        #   a. current build(s),
-        #   b. last passing build,
-        #   c. last failing build,
-        #   d. last completed build
-        info = {}
-        for builder in self.config.builders:
-            builds = self.status.builders.get(builder.name)
+        return self.info
 
-            current = []
-            passing = failing = completed = None
-            if builds is None:
-                # FIXME: Logging!
-                print >>sys.stderr, "warning: no status for '%s'" % (
-                    builder.name)
-                info[builder.name] = None
+    def compute_builder_status(self, name):
+        """
+        compute_builder_status(name) -> dict
+
+        Compute the status of the given builder from its full build history.
+        """
+
+        builds = self.status.builders.get(name)
+
+        current = []
+        passing = failing = completed = None
+        if builds is None:
+            # FIXME: Logging!
+            print >>sys.stderr, "warning: no status for '%s'" % (name,)
+        else:
+            for build in builds[::-1]:
+                # Check if this is an active build.
+                if build.start_time is not None and build.end_time is None:
+                    current.append(build)
+                    continue
+
+                # Otherwise, check the status.
+                if completed is None:
+                    completed = build
+
+                # Track the (a) most recent passing build and (b) oldest
+                # failure which happened after a passing build.
+                if passing is None:
+                    if build.result == 0:
+                        passing = build
+                    else:
+                        failing = build
+
+        return { 'current' : current,
+                 'passing' : passing,
+                 'failing' : failing,
+                 'completed' : completed }
+
+    def update_builder_status(self, info, build):
+        """
+        update_builder_status(info, build) -> dict or None
+
+        Compute the status of a builder after the given build was added or
+        updated, from its previous status. Returns None if the update can't be
+        applied incrementally.
+        """
+
+        current = info['current']
+        completed = info['completed']
+        is_current = build.number in [b.number for b in current]
+
+        # An update to a completed build may change which failure is the oldest,
+        # so rescan.
+        if completed is not None and completed.number == build.number:
+            return None
+
+        # Find the number of the newest build we know about, other than this
+        # one.
+        numbers = [b.number for b in current
+                   if b.number != build.number]
+        if completed is not None:
+            numbers.append(completed.number)
+        is_newest = not numbers or build.number > max(numbers)
+
+        if build.start_time is not None and build.end_time is None:
+            # This is an active build, handle a new build or an update to one
+            # we already know is active.
+            if is_current:
+                current = [(b, build)[b.number == build.number]
+                           for b in current]
+            elif is_newest:
+                current = [build] + current
             else:
-                for build in builds[::-1]:
-                    # Check if this is an active build.
-                    if build.start_time is not None and build.end_time is None:
-                        current.append(build)
-                        continue
-
-                    # Otherwise, check the status.
-                    if completed is None:
-                        completed = build
-
-                    # Track the (a) most recent passing build and (b) oldest
-                    # failure which happened after a passing build.
-                    if passing is None:
-                        if build.result == 0:
-                            passing = build
-                        else:
-                            failing = build
-
-            info[builder.name] = {
-                'current' : current,
-                'passing' : passing,
-                'failing' : failing,
-                'completed' : completed }
-
-        return info
+                return None
+            return dict(info, current = current)
+
+        # Otherwise, this is a completed build, handle it if it is now the
+        # newest completed build.
+        if not is_current and not is_newest:
+            return None
+        if completed is not None and build.number < completed.number:
+            return None
+
+        passing = info['passing']
+        failing = info['failing']
+        if build.result == 0:
+            passing = build
+            failing = None
+        elif failing is None:
+            failing = build
+        return { 'current' : [b for b in current
+                              if b.number != build.number],
+                 'passing' : passing,
+                 'failing' : failing,
+                 'completed' : build }
+
+    def status_changed(self, change):
+        kind = change[0]
+        if kind == 'update_build':
+            name = change[1]['name']
+        else:
+            name = change[1]
+        if name not in self.info:
+            return
+        info = self.info[name]
+
+        # Apply build updates incrementally, if we can.
+        new_info = None
+        if kind == 'update_build':
+            build = self.status.store.get_build(name, change[1]['number'])
+            if build is not None:
+                new_info = self.update_builder_status(info, build)
+        if new_info is None:
+            new_info = self.compute_builder_status(name)
+        self.info[name] = new_info
+
+        for listener in self.listeners:
+            listener(name)
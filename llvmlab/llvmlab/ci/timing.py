@@ -0,0 +1,216 @@
+"""
+Build timing information for the dashboard.
+
+Tracks the series of build durations for each builder, so that the timing
+graphs can be served without scanning the full status, and downsampled to a
+bounded number of points.
+"""
+
+import bisect
+import threading
+
+# The supported aggregates for downsampling.
+aggregates = ('median', 'min', 'max', 'minmax')
+
+def downsample(points, max_points, aggregate = 'median'):
+    """
+    downsample(points, max_points, aggregate = 'median') -> list
+
+    Reduce a list of (x, y) points ordered by x to at most max_points points,
+    by dividing the points into buckets and choosing a representative point
+    from each bucket. The aggregate is one of:
+      median - the point with the median y value,
+      min - the point with the smallest y value,
+      max - the point with the largest y value,
+      minmax - the points with the smallest and largest y values (in x order),
+               using half as many buckets (or the median, if there is only
+               room for one point).
+    """
+
+    if aggregate not in aggregates:
+        raise ValueError, "Unknown aggregate: %r" % (aggregate,)
+    if max_points is None or len(points) <= max_points:
+        return list(points)
+
+    num_buckets = max_points
+    if aggregate == 'minmax':
+        if max_points < 2:
+            aggregate = 'median'
+        else:
+            num_buckets = max_points // 2
+
+    result = []
+    n = len(points)
+    for i in range(num_buckets):
+        bucket = points[i * n // num_buckets:(i + 1) * n // num_buckets]
+        if not bucket:
+            continue
+
+        if aggregate == 'median':
+            by_value = sorted(bucket, key = lambda p: p[1])
+            result.append(by_value[len(by_value) // 2])
+        elif aggregate == 'min':
+            result.append(min(bucket, key = lambda p: p[1]))
+        elif aggregate == 'max':
+            result.append(max(bucket, key = lambda p: p[1]))
+        else:
+            lo = min(bucket, key = lambda p: p[1])
+            hi = max(bucket, key = lambda p: p[1])
+            if lo is hi:
+                result.append(lo)
+            else:
+                result.extend(sorted((lo, hi)))
+    return result
+
+class BuildTimes(object):
+    """
+    BuildTimes object for tracking the durations of the completed builds of each
+    builder, ordered by build number.
+
+    The series are kept up to date from the status changes, and downsampled
+    series are cached until the builder changes. Builds moved to the status
+    archive stay in the series, and the archive is read (once) on the first
+    request for timing information.
+
+    The series are copy-on-write tuples, so the timing points can be computed
+    without taking the status lock.
+    """
+
+    # The maximum number of downsampled series to keep per builder.
+    max_cached_series = 16
+
+    def __init__(self, status):
+        self.status = status
+
+        # Map of builder name to the tuple of (number, duration) pairs for its
+        # completed builds.
+        self.series = {}
+
+        # Map of builder name to the series the cached timing points were
+        # computed from, and the points by (max_points, aggregate).
+        self.points = {}
+
+        # Whether the archived builds have been added to the series, and the
+        # lock held while reading the archive.
+        self.archive_loaded = False
+        self.archive_lock = threading.Lock()
+
+        with self.status.lock:
+            self.add_builds(self.status.find_builds(completed = True))
+            self.status.add_listener(self.status_changed)
+
+    def add_builds(self, builds):
+        # Add the builds in bulk, building each new series once.
+        items = {}
+        for build in builds:
+            if build.start_time is None or build.end_time is None:
+                continue
+            items.setdefault(build.name, []).append(
+                (build.number, build.end_time - build.start_time))
+        for name,new_items in items.items():
+            series = list(self.series.get(name, ())) + new_items
+            series.sort()
+            self.series[name] = tuple(series)
+
+    def add_build(self, build):
+        self.add_builds([build])
+
+    def has_build(self, name, number):
+        series = self.series.get(name, ())
+        index = bisect.bisect_left(series, (number,))
+        return index != len(series) and series[index][0] == number
+
+    def load_archive(self):
+        import llvmlab.ci.status
+        with self.archive_lock:
+            if self.archive_loaded:
+                return
+
+            # Read the archive without holding the status lock, as it can take
+            # a while. The archived builds stay in the series, so any archived
+            # while we read are already there.
+            archived = {}
+            for data in self.status.archive.read():
+                build = llvmlab.ci.status.BuildStatus.fromdata(data)
+                archived[(build.name, build.number)] = build
+
+            # Add the archived builds we don't already have (the archive may
+            # record a build more than once, or a build may still be in the
+            # status).
+            with self.status.lock:
+                self.add_builds([build for build in archived.values()
+                                 if not self.has_build(build.name,
+                                                       build.number)])
+                self.archive_loaded = True
+
+    def remove_build(self, name, number):
+        series = self.series.get(name)
+        if not series:
+            return
+
+        index = bisect.bisect_left(series, (number,))
+        if index != len(series) and series[index][0] == number:
+            self.series[name] = series[:index] + series[index+1:]
+
+    def status_changed(self, change):
+        kind = change[0]
+        if kind in ('remove_builder', 'reset_builder'):
+            name = change[1]
+            self.series.pop(name, None)
+            self.points.pop(name, None)
+        elif kind == 'remove_build':
+            _,name,number = change
+            self.remove_build(name, number)
+        elif kind == 'update_build':
+            name,number = change[1]['name'], change[1]['number']
+            self.remove_build(name, number)
+            build = self.status.store.get_build(name, number)
+            if build is not None:
+                self.add_build(build)
+        elif kind == 'load_builds':
+            # The loaded builds may already have been read from the archive.
+            _,name,numbers = change
+            builds = [self.status.store.get_build(name, number)
+                      for number in numbers
+                      if not self.has_build(name, number)]
+            self.add_builds([b for b in builds
+                             if b is not None])
+        else:
+            # Archiving builds doesn't change the timing history.
+            return
+
+    def get_points(self, name, max_points = None, aggregate = 'median'):
+        """
+        get_points(name, max_points = None, aggregate = 'median') -> list
+
+        Get the timing points for the given builder, as a list of (x, duration)
+        pairs, where x is the position of the build within the builder's
+        history (from 0 to 1). If max_points is given, the points are
+        downsampled to at most that many points (see downsample()).
+        """
+
+        if not self.archive_loaded and self.status.archive is not None:
+            self.load_archive()
+
+        # Use the cached points, if they are for the current series.
+        key = (max_points, aggregate)
+        series = self.series.get(name, ())
+        item = self.points.get(name)
+        if item is not None and item[0] is series and key in item[1]:
+            return item[1][key]
+
+        n = len(series)
+        points = [(float(i) / n, duration)
+                  for i,(_,duration) in enumerate(series)]
+        points = downsample(points, max_points, aggregate)
+
+        # Cache the points (unless the series has changed since).
+        if item is None or item[0] is not series:
+            item = (series, {})
+        cache = item[1]
+        if len(cache) >= self.max_cached_series:
+            cache.clear()
+        cache[key] = points
+        if self.series.get(name, ()) is series:
+            self.points[name] = item
+        return points
@@ -156,8 +156,10 @@ def action_runserver(name, args):
     if opts.profiler:
         app.wsgi_app = werkzeug.contrib.profiler.ProfilerMiddleware(
             app.wsgi_app, stream = open('profiler.log', 'w'))
+    # Serve requests on threads, so the /ci/events streams don't block others.
     app.run(use_reloader = opts.reloader,
-            use_debugger = opts.debugger)
+            use_debugger = opts.debugger,
+            threaded = True)
 
 def action_import_users(name, args):
     """import users from SVN information"""
@@ -3,13 +3,21 @@ import logging
 import logging.handlers
 import os
 import shutil
+import threading
 
 import flask
 
 import llvmlab.data
 import llvmlab.user
+import llvmlab.ci.archive
+import llvmlab.ci.buildchart
+import llvmlab.ci.events
+import llvmlab.ci.journal
+import llvmlab.ci.snapshot
 import llvmlab.ci.summary
 import llvmlab.ci.status
+import llvmlab.ci.store
+import llvmlab.ci.timing
 import llvmlab.ui.ci.views
 import llvmlab.ui.filters
 import llvmlab.ui.frontend.views
@@ -65,6 +73,10 @@ class App(flask.Flask):
             module = __import__(plugins_module, fromlist=['__name__'])
             module.register(app)
 
+        # Stream the changes to the dashboard summary, if a plugin set one up.
+        if app.config.summary is not None:
+            app.config.status_events.watch_summary(app.config.summary)
+
         return app
 
     @staticmethod
@@ -98,6 +110,7 @@ class App(flask.Flask):
     def __init__(self, name):
         super(App, self).__init__(name)
         self.monitor = None
+        self.monitor_lock = threading.Lock()
 
     def load_config(self, config = None, config_path = None):
         if config_path is not None:
@@ -152,22 +165,80 @@ class App(flask.Flask):
         if status is None:
             install_path = self.config["INSTALL_PATH"]
             data_path = os.path.join(install_path, "lab-status.json")
-            data_file = open(data_path, "rb")
-            data_object = flask.json.load(data_file)
-            data_file.close()
-
-            # Create the internal Status object.
-            status = llvmlab.ci.status.Status.fromdata(data_object)
+            data_object = llvmlab.ci.snapshot.load(data_path)
+
+            # Create the build store, if the builds aren't kept in memory.
+            store = None
+            if self.config.get('STATUS_STORE') == 'sqlite':
+                store = llvmlab.ci.store.SQLiteBuildStore(
+                    os.path.join(install_path, "lab-status.db"))
+
+            # Create the internal Status object. If startup is lazy, only the
+            # recent builds are loaded now, and the rest in the background.
+            status = llvmlab.ci.status.Status.fromdata(
+                data_object, store, self.config.get('STATUS_STARTUP_BUILDS'))
+
+            # If the build history is bounded, set up the archive that older
+            # builds are moved to.
+            hot_builds = self.config.get('STATUS_HOT_BUILDS')
+            if hot_builds is not None:
+                status.hot_builds = hot_builds
+                status.archive = llvmlab.ci.archive.BuildArchive(
+                    os.path.join(install_path, "lab-status-archive.json.gz"))
+
+            # If we are journaling, replay the changes since the snapshot.
+            if self.config.get('STATUS_PERSISTENCE') == 'journal':
+                journal_path = os.path.join(install_path, "lab-status.journal")
+                num_changes = 0
+                for change in llvmlab.ci.journal.StatusJournal.read(
+                        journal_path):
+                    status.apply_change(change)
+                    num_changes += 1
+
+                # Start journaling, and fold in the replayed changes.
+                status.journal = llvmlab.ci.journal.StatusJournal(
+                    journal_path)
+                self.config.status = status
+                if num_changes:
+                    self.save_status()
+                    status.journal.reset()
 
         self.config.status = status
 
-    def save_status(self):
+        # Set up the additional masters to monitor, if any. Each is either a
+        # URL, or a dictionary of the URL and its poll options.
+        masters = self.config.get('STATUS_MASTERS')
+        if masters is not None:
+            urls = {}
+            for name,options in masters.items():
+                if isinstance(options, dict):
+                    urls[name] = options['url']
+                else:
+                    urls[name] = options
+            status.set_masters(urls)
+
+        # Create the build chart and timing series, which track the status.
+        self.config.build_chart = llvmlab.ci.buildchart.BuildChart(status)
+        self.config.build_times = llvmlab.ci.timing.BuildTimes(status)
+
+        # Create the stream of status events for live dashboards.
+        self.config.status_events = llvmlab.ci.events.StatusEvents(
+            status, llvmlab.ui.filters.filter_asusertime)
+
+        # Load any builds deferred at startup.
+        if status.pending_builds:
+            llvmlab.ci.status.StatusLoader(self, status).start()
+
+    def save_status(self, data = None):
+        if data is None:
+            with self.config.status.lock:
+                data = self.config.status.todata()
+
         install_path = self.config["INSTALL_PATH"]
         data_path = os.path.join(install_path, "lab-status.json.new")
-        file = open(data_path, 'w')
-        flask.json.dump(self.config.status.todata(), file, indent=2)
-        print >>file
-        file.close()
+        llvmlab.ci.snapshot.save(data, data_path,
+                                 self.config.get('STATUS_SNAPSHOT_FORMAT',
+                                                 'json'))
 
         # Backup the current status.
         backup_path = os.path.join(install_path, "lab-status.json.bak")
@@ -200,8 +271,13 @@ class App(flask.Flask):
         # we can't tell if we are in the actual web app instance.
         #
         # FIXME: Find a nicer solution.
+        #
+        # Requests are served on several threads, so make sure only the first
+        # one starts the monitor.
         if not self.monitor:
-            # Spawn the status monitor thread.
-            self.monitor = self.config.status.start_monitor(self)
+            with self.monitor_lock:
+                if not self.monitor:
+                    # Spawn the status monitor thread.
+                    self.monitor = self.config.status.start_monitor(self)
 
         return flask.Flask.__call__(self, environ, start_response)
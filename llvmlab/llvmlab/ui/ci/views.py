@@ -1,3 +1,7 @@
+import functools
+import hashlib
+import time
+
 import flask
 from flask import abort
 from flask import jsonify
@@ -10,13 +14,68 @@ from flask import current_app
 ci = flask.Module(__name__, url_prefix='/ci', name='ci')
 
 from llvmlab import util
+import llvmlab.ci.buildbot.statusclient
+import llvmlab.ci.timing
+
+def cached_by_status(time_bucket = None):
+    """
+    cached_by_status(time_bucket = None) -> decorator
+
+    Decorator for views which only depend on the status (and the request), which
+    tags the responses with the status generation, and answers conditional
+    requests for an unchanged status without calling the view. If time_bucket is
+    given, the tag also changes every time_bucket seconds, for views which
+    depend on the current time.
+    """
+
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            # The views show the logged in user, so tag them with the user too.
+            etag = current_app.config.status.get_etag()
+            user = session.get('active_user')
+            if user is not None:
+                etag += '-' + hashlib.sha1(user.encode('utf-8')).hexdigest()[:8]
+            if time_bucket is not None:
+                etag += '-%d' % (int(time.time() // time_bucket),)
+
+            # Don't answer from the cache if there are flashed messages to show.
+            if (request.if_none_match.contains(etag) and
+                not session.get('_flashes')):
+                response = current_app.response_class(status = 304)
+            else:
+                response = current_app.make_response(view(*args, **kwargs))
+            response.set_etag(etag)
+            response.headers['Cache-Control'] = 'private, no-cache'
+            return response
+        return wrapper
+    return decorator
 
 @ci.route('/')
+@cached_by_status()
 def dashboard():
+    # Pass the summary to the page, along with the id of the last status event,
+    # so the page can apply the later events from the event stream.
+    cfg = current_app.config.summary.config
+    status_events = current_app.config.status_events
+    last_event_id = status_events.get_last_id()
+    dashboard_data = {
+        'phases' : [{ 'index' : i,
+                      'number' : phase.number,
+                      'name' : phase.name,
+                      'phase_builder' : phase.phase_builder }
+                    for i,phase in enumerate(cfg.phases)],
+        'validation_builder' : cfg.validation_builder,
+        'summary' : status_events.get_summary_data() }
     return render_template("dashboard.html",
-                           ci_config=current_app.config.summary.config)
+                           ci_config=cfg,
+                           events_url=url_for('status_events',
+                                              last_event_id=last_event_id),
+                           dashboard_data=flask.json.dumps(
+                               dashboard_data).replace('</', '<\\/'))
 
 @ci.route('/phase/<int:index>/<source_stamp>')
+@cached_by_status()
 def phase_popup(index, source_stamp):
     cfg = current_app.config.summary.config
 
@@ -28,9 +87,10 @@ def phase_popup(index, source_stamp):
     phase = cfg.phases[index]
 
     # Lookup the latest builds associated with this revision.
+    status = current_app.config.status
     phased_builds = dict(
-        (builder, [b for b in current_app.config.status.builders.get(builder,[])
-                   if b.source_stamp == source_stamp])
+        (builder, status.find_builds(names = [builder],
+                                     source_stamp = source_stamp))
         for builder in phase.builder_names)
     return render_template("phase_popup.html",
                            ci_config=current_app.config.summary.config,
@@ -38,6 +98,7 @@ def phase_popup(index, source_stamp):
                            phased_builds = phased_builds)
 
 @ci.route('/latest_release')
+@cached_by_status()
 def latest_release():
     return render_template("latest_release.html",
                            ci_config=current_app.config.summary.config)
@@ -45,73 +106,104 @@ def latest_release():
 @ci.route('/monitor')
 def buildbot_monitor():
     return render_template("buildbot_monitor.html",
-                           bb_status=current_app.config.status)
+                           bb_status=current_app.config.status,
+                           monitor=current_app.monitor)
+
+@ci.route('/push', methods=['POST'])
+def push_status():
+    # Only accept status pushes if enabled, and (if configured) from a master
+    # which knows the shared secret.
+    if not current_app.config.get('STATUS_PUSH_ENABLED'):
+        abort(404)
+    secret = current_app.config.get('STATUS_PUSH_SECRET')
+    if secret and not util.secure_compare(request.form.get('secret', ''),
+                                          secret):
+        abort(403)
+
+    # Pushes from the additional masters give the master name.
+    master = request.args.get('master')
+    if master is not None and master not in current_app.config.status.masters:
+        abort(404)
+    if current_app.monitor is None:
+        abort(503)
+    monitor = current_app.config.status.monitors.get(master)
+    if monitor is None:
+        abort(503)
+
+    # The packets are posted in the format used by the buildbot HttpStatusPush
+    # status target.
+    try:
+        packets = flask.json.loads(request.form['packets'])
+    except (KeyError, ValueError):
+        abort(400)
+    if not isinstance(packets, list):
+        abort(400)
+    for packet in packets:
+        if not llvmlab.ci.buildbot.statusclient.is_valid_packet(packet):
+            abort(400)
+    monitor.push_packets(packets)
+    return 'ok'
+
+@ci.route('/events')
+def status_events():
+    # Stream the status events to the client, as server-sent events. The client
+    # gives the id of the last event it has seen, either when it connects or
+    # when it reconnects.
+    events = current_app.config.status_events
+    last_id = request.headers.get('Last-Event-ID',
+                                  request.args.get('last_event_id'))
+    if last_id is None:
+        last_id = events.get_last_id()
+    keepalive_interval = current_app.config.get('STATUS_EVENTS_KEEPALIVE', 15.)
+
+    def stream():
+        waker = util.Waker()
+        events.add_waiter(waker)
+        try:
+            event_id = last_id
+            while 1:
+                items = events.get_events(event_id)
+
+                # If the client can't catch up, tell it to reload.
+                if items is None:
+                    yield 'event: reset\ndata: {}\n\n'
+                    return
+
+                for event_id,kind,data in items:
+                    yield 'id: %s\nevent: %s\ndata: %s\n\n' % (
+                        event_id, kind, flask.json.dumps(data))
+
+                # Wait for more events, sending a comment every so often to keep
+                # the connection open.
+                if not items:
+                    waker.wait(time.time() + keepalive_interval)
+                    if events.get_last_id() == event_id:
+                        yield ': keepalive\n\n'
+        finally:
+            events.remove_waiter(waker)
+            waker.close()
+
+    return current_app.response_class(
+        stream(), mimetype='text/event-stream',
+        headers={ 'Cache-Control' : 'no-cache',
+                  'X-Accel-Buffering' : 'no' })
 
 @ci.route('/build_chart')
+@cached_by_status(time_bucket = 60)
 def build_chart():
-    import time
-
     # Determine the render constants.
     k_days_data = int(request.args.get('days', 1))
     k_pixels_per_minute = float(request.args.get('pixels_per_minute', .5))
 
-    # Aggregate builds by slave, for completed builds within the desired time
-    # frame.
-    current_time = time.time()
-    builders = current_app.config.status.builders
-    slave_builders = util.multidict(
-        (build.slave, build)
-        for builds in builders.values()
-        for build in builds
-        if build.end_time is not None
-        if current_time - build.start_time < 60 * 60 * 24 * k_days_data)
-
-    # Compute the build chart.
-    class ChartItem(object):
-        def __init__(self, build, color, left, width):
-            self.build = build
-            self.color = color
-            self.left = left
-            self.width = width
-    builder_colors = dict((name, util.make_dark_color(float(i) / len(builders)))
-                          for i,name in enumerate(builders))
-    build_chart_data = {}
-    max_x = 0
-    min_time = min(build.start_time
-                   for builds in slave_builders.values()
-                   for build in builds)
-    for slave, builders in slave_builders.items():
-        # Order the builders by time.
-        builders.sort(key = lambda b: b.start_time)
-        
-        # Aggregate builds by builder type.
-        builds_by_type = util.multidict(
-            (build.name, build)
-            for build in builders)
-
-        # Create the char items.
-        rows = []
-        for name,builds in util.sorted(builds_by_type.items()):
-            color = builder_colors[name]
-            hex_color = '%02x%02x%02x' % tuple(int(x*255)
-                                           for x in color)
-            rows.append([])
-            for build in builds:
-                elapsed = build.end_time - build.start_time
-                width = max(1, int(k_pixels_per_minute * elapsed / 60))
-                left = int(k_pixels_per_minute *
-                           (build.start_time - min_time) / 60)
-                max_x = max(max_x, left + width)
-                rows[-1].append(ChartItem(build, hex_color, left, width))
-        build_chart_data[slave] = rows
-
-    build_chart = { 'data' : build_chart_data,
-                    'max_x' : max_x }
+    # Get the build chart, for completed builds within the desired time frame.
+    build_chart = current_app.config.build_chart.get_chart(
+        k_days_data, k_pixels_per_minute)
     return render_template("build_chart.html",
                            bb_status = current_app.config.status,
                            build_chart = build_chart)
 
 @ci.route('/phase_description/<int:index>')
+@cached_by_status()
 def phase_description(index):
     cfg = current_app.config.summary.config
 
@@ -125,6 +217,7 @@ def phase_description(index):
 
 @ci.route('/times')
 @ci.route('/times/<int:index>')
+@cached_by_status()
 def phase_timing(index=None):
     cfg = current_app.config.summary.config
 
@@ -147,19 +240,27 @@ def phase_timing(index=None):
     else:
         builders_to_time = phase.builder_names
 
-    # Get the builds to report timing information for.
-    status = current_app.config.status
-    builders = dict((name, [b for b in status.builders.get(name, [])
-                            if b.end_time is not None])
-                    for name in builders_to_time)
+    # Determine how to downsample the timing data, if requested.
+    max_points = request.args.get('max_points')
+    if max_points is not None:
+        try:
+            max_points = int(max_points)
+        except ValueError:
+            abort(400)
+        if max_points < 1:
+            abort(400)
+    aggregate = request.args.get('aggregate', 'median')
+    if aggregate not in llvmlab.ci.timing.aggregates:
+        abort(400)
 
     # Return the timing data as a json object.
+    build_times = current_app.config.build_times
+    builders_to_time = util.sorted(set(builders_to_time))
     data = []
-    for i,(name,builds) in enumerate(util.sorted(builders.items())):
-        color = list(util.make_dark_color(float(i) / len(builders)))
+    for i,name in enumerate(builders_to_time):
+        color = list(util.make_dark_color(float(i) / len(builders_to_time)))
         hex_color = '%02x%02x%02x' % tuple(int(x*255)
                                            for x in color)
-        points = [(float(i) / len(builds), b.end_time - b.start_time)
-                  for i,b in enumerate(builds)]
+        points = build_times.get_points(name, max_points, aggregate)
         data.append((name, points, color, hex_color))
     return flask.jsonify(data = data)
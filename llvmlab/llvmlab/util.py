@@ -1,18 +1,53 @@
 import colorsys
+import errno
+import fcntl
+import hmac
+import os
+import select
+import time
 
 __all__ = []
 
 class simple_repr_mixin(object):
+    __slots__ = ()
+
     def __repr__(self):
+        if hasattr(self, '__dict__'):
+            items = self.__dict__.items()
+        else:
+            items = [(k, getattr(self, k)) for k in self.__slots__]
         return "%s(%s)" % (self.__class__.__name__,
                            ", ".join("%s=%r" % (k,v)
-                                     for k,v in sorted(self.__dict__.items())))
+                                     for k,v in sorted(items)))
 
 def sorted(items):
     items = list(items)
     items.sort()
     return items
 
+def secure_compare(a, b):
+    """
+    secure_compare(a, b) -> bool
+
+    Compare two strings in time independent of their contents, for checking
+    secrets.
+    """
+
+    if isinstance(a, unicode):
+        a = a.encode('utf-8')
+    if isinstance(b, unicode):
+        b = b.encode('utf-8')
+    if hasattr(hmac, 'compare_digest'):
+        return hmac.compare_digest(a, b)
+
+    # Older Pythons don't have compare_digest.
+    if len(a) != len(b):
+        return False
+    result = 0
+    for x,y in zip(a, b):
+        result |= ord(x) ^ ord(y)
+    return result == 0
+
 def make_dark_color(h):
     h = h % 1.
     s = 0.95
@@ -44,3 +79,50 @@ class multidict(object):
         return len(self.data)
     def get(self, key, default=None):
         return self.data.get(key, default)
+
+class Waker(object):
+    """
+    Waker object for blocking a thread until a deadline, or until another thread
+    wakes it up.
+
+    We wait with select() on a pipe, as a timed wait on a threading primitive in
+    Python 2 is a polling loop.
+    """
+
+    def __init__(self):
+        self.pipe = os.pipe()
+        for fd in self.pipe:
+            flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+            fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+
+    def close(self):
+        for fd in self.pipe:
+            os.close(fd)
+
+    def wakeup(self):
+        try:
+            os.write(self.pipe[1], 'x')
+        except OSError, err:
+            # If the pipe is full, the waiter is already due to wake up.
+            if err.errno != errno.EAGAIN:
+                raise
+
+    def wait(self, deadline = None):
+        """
+        wait(deadline = None)
+
+        Wait until the given deadline (or forever, if None), or until woken up.
+        """
+
+        if deadline is None:
+            timeout = None
+        else:
+            timeout = max(0., deadline - time.time())
+        readable,_,_ = select.select([self.pipe[0]], [], [], timeout)
+        if readable:
+            try:
+                while os.read(self.pipe[0], 4096):
+                    pass
+            except OSError, err:
+                if err.errno != errno.EAGAIN:
+                    raise
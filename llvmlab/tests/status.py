@@ -0,0 +1,555 @@
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+
+import llvmlab.ci.journal
+from llvmlab.ci import archive
+from llvmlab.ci import buildchart
+from llvmlab.ci import config
+from llvmlab.ci import events
+from llvmlab.ci import snapshot
+from llvmlab.ci import status
+from llvmlab.ci import store
+from llvmlab.ci import summary
+from llvmlab.ci import timing
+from llvmlab.ui import app
+
+def make_build(name, number, source_stamp = None, result = 0,
+               start_time = 10.0, end_time = 20.0, slave = 'slave'):
+    if source_stamp is None:
+        source_stamp = str(100 + number)
+    return status.BuildStatus(name, number, source_stamp, result,
+                              start_time, end_time, slave)
+
+class TestStatus(unittest.TestCase):
+    def create_store(self):
+        return None
+
+    def setUp(self):
+        self.status = status.Status(None, {}, store = self.create_store())
+
+    def update_build(self, *args, **kwargs):
+        build = make_build(*args, **kwargs)
+        self.status.apply_change(('update_build', build.todata()))
+
+    def test_apply_change(self):
+        self.status.apply_change(('add_builder', 'a'))
+        self.update_build('a', 2)
+        self.update_build('a', 1, end_time = None)
+        self.assertEqual([b.number for b in self.status.builders['a']], [1, 2])
+
+        self.update_build('a', 1, result = 2)
+        build = self.status.build_map['a'][1]
+        self.assertEqual((build.result, build.end_time), (2, 20.0))
+
+        self.status.apply_change(('remove_build', 'a', 2))
+        self.assertEqual([b.number for b in self.status.builders['a']], [1])
+        self.status.apply_change(('reset_builder', 'a'))
+        self.assertEqual(list(self.status.builders['a']), [])
+        self.status.apply_change(('remove_builder', 'a'))
+        self.assertEqual(dict(self.status.builders.items()), {})
+
+    def test_find_builds(self):
+        self.update_build('a', 1, source_stamp = '10', slave = 's1')
+        self.update_build('a', 2, source_stamp = '11', slave = 's2',
+                          start_time = 30.0, end_time = None)
+        self.update_build('b', 1, source_stamp = '10', slave = 's2',
+                          start_time = 40.0)
+
+        def find(**kwargs):
+            return [(b.name, b.number)
+                    for b in self.status.find_builds(**kwargs)]
+        self.assertEqual(sorted(find()), [('a', 1), ('a', 2), ('b', 1)])
+        self.assertEqual(find(names = ['a']), [('a', 1), ('a', 2)])
+        self.assertEqual(sorted(find(source_stamp = '10')),
+                         [('a', 1), ('b', 1)])
+        self.assertEqual(find(names = ['a'], source_stamp = '10'), [('a', 1)])
+        self.assertEqual(sorted(find(slave = 's2')), [('a', 2), ('b', 1)])
+        self.assertEqual(sorted(find(min_start_time = 25.0)),
+                         [('a', 2), ('b', 1)])
+        self.assertEqual(find(completed = False), [('a', 2)])
+
+    def test_find_builds_by_source_stamp(self):
+        def find(source_stamp):
+            return [b.number for b in self.status.find_builds(
+                    names = ['a'], source_stamp = source_stamp)]
+
+        self.update_build('a', 2, source_stamp = '10')
+        self.update_build('a', 1, source_stamp = '10')
+        self.update_build('a', 3, source_stamp = '11')
+        self.assertEqual(find('10'), [1, 2])
+
+        # The index follows source stamp changes, removals and resets.
+        self.update_build('a', 2, source_stamp = '11')
+        self.assertEqual((find('10'), find('11')), ([1], [2, 3]))
+        self.status.apply_change(('remove_build', 'a', 3))
+        self.assertEqual(find('11'), [2])
+        self.status.apply_change(('reset_builder', 'a'))
+        self.assertEqual((find('10'), find('11')), ([], []))
+
+    def test_archive_old_builds(self):
+        path = tempfile.mkdtemp()
+        try:
+            self.status.hot_builds = 2
+            self.status.archive = archive.BuildArchive(
+                os.path.join(path, 'archive.json.gz'))
+            for number in (1, 2, 3, 4):
+                self.update_build('a', number)
+            self.update_build('b', 1)
+
+            # Only the most recent builds are kept, and the rest are archived.
+            self.status.archive_old_builds()
+            self.assertEqual([b.number for b in self.status.builders['a']],
+                             [3, 4])
+            self.assertEqual([b.number for b in self.status.builders['b']],
+                             [1])
+            self.assertEqual([(d['name'], d['number'])
+                              for d in self.status.archive.read()],
+                             [('a', 1), ('a', 2)])
+
+            # Archived builds stay in the timing history. The archive is read
+            # without holding the status lock.
+            read = self.status.archive.read
+            locked = []
+            def check_lock():
+                if self.status.lock.acquire(False):
+                    self.status.lock.release()
+                else:
+                    locked.append(True)
+            def checked_read(*args):
+                thread = threading.Thread(target = check_lock)
+                thread.start()
+                thread.join()
+                return read(*args)
+            self.status.archive.read = checked_read
+            build_times = timing.BuildTimes(self.status)
+            self.assertEqual(len(build_times.get_points('a')), 4)
+            self.assertEqual(locked, [])
+        finally:
+            shutil.rmtree(path)
+
+    def test_archive_keeps_passing(self):
+        path = tempfile.mkdtemp()
+        try:
+            self.status.hot_builds = 2
+            self.status.archive = archive.BuildArchive(
+                os.path.join(path, 'archive.json.gz'))
+            s = summary.Summary(
+                config.Config([], [config.Builder('a')], [], 'a'), self.status)
+            self.update_build('a', 1)
+            self.update_build('a', 2)
+            for number in (3, 4, 5):
+                self.status.apply_change((
+                        'update_build',
+                        make_build('a', number, result = 2).todata()))
+
+            # The last passing build is kept for the summary.
+            self.status.archive_old_builds()
+            self.assertEqual([b.number for b in self.status.builders['a']],
+                             [2, 3, 4, 5])
+            info = s.get_current_status()['a']
+            self.assertEqual(info['passing'].number, 2)
+            self.assertEqual(info['failing'].number, 3)
+        finally:
+            shutil.rmtree(path)
+
+class TestBuildArchive(unittest.TestCase):
+    def test_torn_write(self):
+        path = tempfile.mkdtemp()
+        try:
+            archive_path = os.path.join(path, 'archive.json.gz')
+            archive.BuildArchive(archive_path).append([make_build('a', 1)])
+
+            # Simulate a crash in the middle of appending a member.
+            archive.BuildArchive(archive_path).append([make_build('a', 2)])
+            size = os.path.getsize(archive_path)
+            file = open(archive_path, 'r+b')
+            file.truncate(size - 5)
+            file.close()
+
+            # After a restart, the incomplete member is dropped before we append
+            # more builds, so they can be read.
+            build_archive = archive.BuildArchive(archive_path)
+            build_archive.append([make_build('a', 3)])
+            build_archive.append([make_build('a', 4)])
+            self.assertEqual([d['number'] for d in build_archive.read()],
+                             [1, 3, 4])
+        finally:
+            shutil.rmtree(path)
+
+class TestConcurrentReads(unittest.TestCase):
+    def test_stress(self):
+        # Apply changes on one thread while others read the status without
+        # taking the lock, and check the readers only see complete builds
+        # (where the result and duration are derived from the start time).
+        s = status.Status(None, { 'a' : [], 'b' : [] })
+        cfg = config.Config([], [config.Builder('a'), config.Builder('b')],
+                            [], 'a')
+        summ = summary.Summary(cfg, s)
+        build_times = timing.BuildTimes(s)
+
+        def make_consistent_build(name, number, value):
+            return make_build(name, number, source_stamp = str(value % 7),
+                              result = value % 3, start_time = float(value),
+                              end_time = float(value) + number)
+
+        def check_build(build):
+            self.assertEqual(build.result, int(build.start_time) % 3)
+            self.assertEqual(build.end_time - build.start_time, build.number)
+            self.assertEqual(build.source_stamp, str(int(build.start_time) % 7))
+
+        done = threading.Event()
+        errors = []
+        def write():
+            rng = random.Random(0)
+            for value in range(5000):
+                name = rng.choice('ab')
+                r = rng.random()
+                with s.lock:
+                    if r < 0.01:
+                        s.apply_change(('reset_builder', name))
+                    elif r < 0.1:
+                        s.apply_change(('remove_build', name,
+                                        rng.randrange(50)))
+                    else:
+                        s.apply_change(('update_build', make_consistent_build(
+                                        name, rng.randrange(50),
+                                        value).todata()))
+            done.set()
+
+        def read():
+            try:
+                while not done.is_set():
+                    for name,builds in s.builders.items():
+                        numbers = [b.number for b in builds]
+                        self.assertEqual(numbers, sorted(set(numbers)))
+                        for build in builds:
+                            check_build(build)
+                    for build in s.find_builds(source_stamp = '3'):
+                        check_build(build)
+                    for info in summ.get_current_status().values():
+                        for build in info['current']:
+                            check_build(build)
+                    build_times.get_points('a', 10)
+            except Exception, e:
+                errors.append(e)
+
+        old_interval = sys.getcheckinterval()
+        sys.setcheckinterval(10)
+        try:
+            threads = [threading.Thread(target = read) for i in range(4)]
+            threads.append(threading.Thread(target = write))
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            sys.setcheckinterval(old_interval)
+        self.assertEqual(errors, [])
+
+        # The readers see the final status.
+        self.assertEqual(len(build_times.get_points('a')),
+                         len(s.find_builds(names = ['a'], completed = True)))
+
+class TestSQLiteStatus(TestStatus):
+    def create_store(self):
+        return store.SQLiteBuildStore(':memory:')
+
+    def test_import(self):
+        # Builds for builders the store doesn't have are imported.
+        self.status = status.Status(None, { 'a' : [make_build('a', 1)] },
+                                    store = self.status.store)
+        self.assertEqual([b.number for b in self.status.builders['a']], [1])
+
+class TestPendingBuilds(unittest.TestCase):
+    def test_load(self):
+        data = status.Status(None, {
+                'a' : [make_build('a', i) for i in (1, 2, 3, 4)],
+                'b' : [make_build('b', 1)] }).todata()
+        s = status.Status.fromdata(data, recent_builds = 2)
+        times = timing.BuildTimes(s)
+        self.assertEqual([b.number for b in s.builders['a']], [3, 4])
+        self.assertEqual(s.pending_builds.keys(), ['a'])
+        self.assertEqual(len(times.get_points('a')), 2)
+
+        # The pending builds are still saved.
+        self.assertEqual(sorted(s.todata()['builders']),
+                         sorted(data['builders']))
+
+        # Changing a builder loads its pending builds first.
+        s.apply_change(('remove_build', 'a', 4))
+        self.assertEqual([b.number for b in s.builders['a']], [1, 2, 3])
+        self.assertEqual(len(times.get_points('a')), 3)
+        self.assertEqual(s.load_all_pending_builds(), 0)
+
+class TestSummary(unittest.TestCase):
+    def test_incremental(self):
+        # Apply a random series of changes, and check the incremental summary
+        # always matches the summary computed from scratch.
+        s = status.Status(None, { 'a' : [], 'b' : [] })
+        cfg = config.Config([], [config.Builder('a'), config.Builder('b')],
+                            [], 'a')
+        summ = summary.Summary(cfg, s)
+
+        rng = random.Random(0)
+        next_number = 0
+        for i in range(2000):
+            r = rng.random()
+            if r < 0.01:
+                s.apply_change(('reset_builder', 'a'))
+            elif r < 0.05 and s.builders.get('a'):
+                s.apply_change(('remove_build', 'a',
+                                rng.choice(s.builders['a']).number))
+            elif r < 0.5:
+                next_number += 1
+                build = make_build('a', next_number, end_time = None)
+                s.apply_change(('update_build', build.todata()))
+            elif s.builders.get('a'):
+                # Complete (or update) a build, usually the oldest active one.
+                builds = [b for b in s.builders['a']
+                          if b.end_time is None]
+                if not builds or rng.random() < 0.1:
+                    builds = s.builders['a']
+                build = make_build('a', builds[0].number,
+                                   result = rng.choice((0, 0, 2)))
+                s.apply_change(('update_build', build.todata()))
+
+            info = summ.get_current_status()
+            self.assertEqual(info['a'], summ.compute_builder_status('a'))
+            self.assertEqual(info['b'], summ.compute_builder_status('b'))
+
+class TestStatusEvents(unittest.TestCase):
+    def test_events(self):
+        s = status.Status(None, { 'a' : [] })
+        cfg = config.Config([], [config.Builder('a')], [], 'a')
+        status_events = events.StatusEvents(s)
+        status_events.watch_summary(summary.Summary(cfg, s))
+        last_id = status_events.get_last_id()
+        self.assertEqual(status_events.get_events(last_id), [])
+
+        s.apply_change(('update_build',
+                        make_build('a', 1, end_time = None).todata()))
+        s.apply_change(('update_build', make_build('a', 1).todata()))
+        items = status_events.get_events(last_id)
+        self.assertEqual([kind for _,kind,_ in items],
+                         ['build_added', 'summary', 'build_completed',
+                          'summary'])
+        self.assertEqual(items[-1][2]['completed']['number'], 1)
+        self.assertEqual(status_events.get_events(items[-1][0]), [])
+
+        # Clients which can't catch up are told to reload.
+        self.assertEqual(status_events.get_events('0-0'), None)
+        status_events.events.clear()
+        self.assertEqual(status_events.get_events(last_id), None)
+
+class TestBuildChart(unittest.TestCase):
+    def get_rows(self, chart):
+        return dict((slave, [[(item.build.name, item.build.number, item.left,
+                               item.width) for item in row]
+                             for row in rows])
+                    for slave,rows in chart['data'].items())
+
+    def test_chart(self):
+        s = status.Status(None, {})
+        chart = buildchart.BuildChart(s)
+        self.assertEqual(chart.get_chart(1, 1., 1000.),
+                         { 'data' : {}, 'max_x' : 0 })
+
+        def update(name, number, slave, start_time, end_time = None):
+            build = make_build(name, number, slave = slave,
+                               start_time = start_time, end_time = end_time)
+            s.apply_change(('update_build', build.todata()))
+        update('a', 1, 's1', 0., 600.)
+        update('a', 2, 's1', 600., 1200.)
+        update('b', 1, 's1', 300., 900.)
+        update('b', 2, 's2', 900.)
+
+        # Only completed builds, started within the window, are charted.
+        day = 60 * 60 * 24
+        self.assertEqual(self.get_rows(chart.get_chart(1, 1., day + 100.)), {
+                's1' : [[('a', 2, 5, 10)], [('b', 1, 0, 10)]] })
+        self.assertEqual(self.get_rows(chart.get_chart(1, 1., day - 1.)), {
+                's1' : [[('a', 1, 0, 10), ('a', 2, 10, 10)],
+                        [('b', 1, 5, 10)]] })
+
+        # The cached chart is updated when builds change.
+        update('b', 2, 's2', 900., 1500.)
+        s.apply_change(('remove_build', 'a', 1))
+        self.assertEqual(self.get_rows(chart.get_chart(1, 1., day - 1.)), {
+                's1' : [[('a', 2, 5, 10)], [('b', 1, 0, 10)]],
+                's2' : [[('b', 2, 10, 10)]] })
+        s.apply_change(('reset_builder', 'b'))
+        self.assertEqual(self.get_rows(chart.get_chart(1, 1., day - 1.)), {
+                's1' : [[('a', 2, 0, 10)]] })
+
+class TestBuildTimes(unittest.TestCase):
+    def test_downsample(self):
+        points = [(i, y) for i,y in enumerate([5, 1, 3, 9, 2, 4, 8, 7])]
+        self.assertEqual(timing.downsample(points, 8), points)
+        self.assertEqual(timing.downsample(points, 2, 'median'),
+                         [(0, 5), (7, 7)])
+        self.assertEqual(timing.downsample(points, 2, 'min'),
+                         [(1, 1), (4, 2)])
+        self.assertEqual(timing.downsample(points, 2, 'max'),
+                         [(3, 9), (6, 8)])
+        self.assertEqual(timing.downsample(points, 4, 'minmax'),
+                         [(1, 1), (3, 9), (4, 2), (6, 8)])
+        self.assertEqual(timing.downsample(points, 1, 'minmax'), [(0, 5)])
+        self.assertEqual(len(timing.downsample(points * 1000, 100)), 100)
+
+    def test_series(self):
+        s = status.Status(None, { 'a' : [make_build('a', 1, end_time = 15.0),
+                                         make_build('a', 3, end_time = None)] })
+        build_times = timing.BuildTimes(s)
+        self.assertEqual(build_times.get_points('a'), [(0.0, 5.0)])
+
+        # The series (and cached points) follow the status.
+        s.apply_change(('update_build', make_build('a', 3).todata()))
+        s.apply_change(('update_build', make_build('a', 2, end_time = 40.0,
+                                                   ).todata()))
+        self.assertEqual(build_times.get_points('a'),
+                         [(0.0, 5.0), (1/3., 30.0), (2/3., 10.0)])
+        self.assertEqual(build_times.get_points('a', 1), [(2/3., 10.0)])
+        s.apply_change(('remove_build', 'a', 1))
+        self.assertEqual(build_times.get_points('a', 1), [(0.0, 30.0)])
+        s.apply_change(('reset_builder', 'a'))
+        self.assertEqual(build_times.get_points('a'), [])
+
+class TestSnapshot(unittest.TestCase):
+    def test_round_trip(self):
+        data = status.Status(None, { 'a' : [make_build('a', 1),
+                                            make_build('a', 2)] }).todata()
+        path = tempfile.mkdtemp()
+        try:
+            # Save the data once, so it compares equal to the loaded data.
+            snapshot_path = os.path.join(path, 'lab-status.json')
+            snapshot.save(data, snapshot_path)
+            data = snapshot.load(snapshot_path)
+            for format in snapshot.formats:
+                snapshot.save(data, snapshot_path, format)
+                self.assertEqual(snapshot.detect_format(snapshot_path),
+                                 ('json', 'gzip')[format == 'gzip'])
+                self.assertEqual(snapshot.load(snapshot_path), data)
+        finally:
+            shutil.rmtree(path)
+
+class TestStatusJournal(unittest.TestCase):
+    def setUp(self):
+        self.install_path = tempfile.mkdtemp()
+
+        # Create an instance with an empty status snapshot.
+        instance = self.create_instance(status.Status(None, {}))
+        instance.save_status()
+
+    def tearDown(self):
+        shutil.rmtree(self.install_path)
+
+    def create_instance(self, status = None):
+        instance = app.App.create_test_instance()
+        instance.config['INSTALL_PATH'] = self.install_path
+        instance.config['STATUS_PERSISTENCE'] = 'journal'
+        instance.load_status(status)
+        return instance
+
+    def test_replay(self):
+        instance = self.create_instance()
+        journal = instance.config.status.journal
+        instance.config.status.apply_change(('add_builder', 'a'))
+        instance.config.status.apply_change((
+                'update_build', make_build('a', 1).todata()))
+
+        # Simulate a crash in the middle of compaction, and in the middle of a
+        # write.
+        journal.rotate()
+        instance.config.status.apply_change((
+                'update_build', make_build('a', 2).todata()))
+        journal.file.write('["update_build", {')
+        journal.file.close()
+
+        # The changes are replayed on restart, and folded into the snapshot.
+        instance = self.create_instance()
+        builds = instance.config.status.builders['a']
+        self.assertEqual([b.number for b in builds], [1, 2])
+        self.assertEqual(list(llvmlab.ci.journal.StatusJournal.read(
+                    os.path.join(self.install_path, 'lab-status.journal'))), [])
+
+        instance = self.create_instance()
+        builds = instance.config.status.builders['a']
+        self.assertEqual([b.number for b in builds], [1, 2])
+
+    def test_torn_first_record(self):
+        instance = self.create_instance()
+        journal = instance.config.status.journal
+
+        # Simulate a crash in the middle of the first write, so there is nothing
+        # to replay.
+        journal.file.write('["add_builder", ')
+        journal.file.close()
+
+        # The changes after the restart are still replayed.
+        instance = self.create_instance()
+        instance.config.status.apply_change(('add_builder', 'a'))
+        instance.config.status.journal.file.close()
+        instance = self.create_instance()
+        self.assertEqual(instance.config.status.builders.keys(), ['a'])
+
+    def test_repeated_rotate(self):
+        instance = self.create_instance()
+        journal = instance.config.status.journal
+        instance.config.status.apply_change(('add_builder', 'a'))
+
+        # Simulate the snapshots failing to save, twice.
+        journal.rotate()
+        instance.config.status.apply_change((
+                'update_build', make_build('a', 1).todata()))
+        journal.rotate()
+        instance.config.status.apply_change((
+                'update_build', make_build('a', 2).todata()))
+        journal.file.close()
+
+        self.assertEqual([c[0] for c in llvmlab.ci.journal.StatusJournal.read(
+                    journal.path)],
+                         ['add_builder', 'update_build', 'update_build'])
+        instance = self.create_instance()
+        builds = instance.config.status.builders['a']
+        self.assertEqual([b.number for b in builds], [1, 2])
+
+class TestViewCaching(unittest.TestCase):
+    def test_etag(self):
+        instance = app.App.create_test_instance()
+        s = instance.config.status
+        instance.config.summary = summary.Summary(
+            config.Config([], [config.Builder('a')], [], 'a'), s)
+        client = instance.test_client()
+
+        rv = client.get('/ci/times')
+        self.assertEqual(rv.status_code, 200)
+        etag = rv.headers['ETag']
+        self.assertEqual(client.get('/ci/times', headers = {
+                    'If-None-Match' : etag }).status_code, 304)
+
+        # Any change to the status invalidates the tag.
+        s.apply_change(('add_builder', 'a'))
+        rv = client.get('/ci/times', headers = { 'If-None-Match' : etag })
+        self.assertEqual(rv.status_code, 200)
+        self.assertNotEqual(rv.headers['ETag'], etag)
+
+class TestTimesView(unittest.TestCase):
+    def test_arguments(self):
+        instance = app.App.create_test_instance()
+        instance.config.summary = summary.Summary(
+            config.Config([], [config.Builder('a')], [], 'a'),
+            instance.config.status)
+        client = instance.test_client()
+
+        self.assertEqual(client.get('/ci/times?max_points=10').status_code,
+                         200)
+        for query in ('max_points=abc', 'max_points=0', 'aggregate=mean'):
+            self.assertEqual(client.get('/ci/times?' + query).status_code, 400)
+
+if __name__ == '__main__':
+    unittest.main()
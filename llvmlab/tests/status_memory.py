@@ -0,0 +1,78 @@
+"""
+Memory benchmark for the in-memory CI status.
+
+Builds a synthetic status of 100k builds, once with plain (__dict__) build
+objects and once with the compact BuildStatus objects, and reports the growth
+in RSS for each. Run directly:
+
+  python tests/status_memory.py [num_builds]
+"""
+
+import os
+import resource
+import sys
+
+from llvmlab.ci import status
+
+import synthetic
+
+class DictBuildStatus(object):
+    # The build representation before BuildStatus used slots.
+    def __init__(self, name, number, source_stamp,
+                 result, start_time, end_time, slave):
+        self.name = name
+        self.number = number
+        self.source_stamp = source_stamp
+        self.result = result
+        self.start_time = start_time
+        self.end_time = end_time
+        self.slave = slave
+
+def get_rss_kb():
+    # The current RSS, from /proc if we can (ru_maxrss is only the peak).
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+        return pages * resource.getpagesize() // 1024
+    except IOError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def measure(build_class, num_builds):
+    # Measure in a child process, so each representation starts from the same
+    # baseline.
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        before = get_rss_kb()
+        builders = synthetic.make_builders(num_builds, build_class)
+        st = status.Status(None, builders)
+        after = get_rss_kb()
+        os.write(write_fd, '%d %d' % (before, after))
+        os._exit(0)
+
+    os.close(write_fd)
+    result = os.read(read_fd, 100)
+    os.close(read_fd)
+    os.waitpid(pid, 0)
+    return map(int, result.split())
+
+def main():
+    if len(sys.argv) > 1:
+        num_builds = int(sys.argv[1])
+    else:
+        num_builds = 100000
+
+    print "RSS for a status of %d builds:" % (num_builds,)
+    results = {}
+    for label,build_class in (('dict', DictBuildStatus),
+                              ('slots', status.BuildStatus)):
+        before,after = measure(build_class, num_builds)
+        results[label] = after - before
+        print "  %-5s: %8d KB before, %8d KB after, %8d KB used" % (
+            label, before, after, after - before)
+    print "  saved: %.1f%%" % (
+        100. * (results['dict'] - results['slots']) / results['dict'],)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+"""
+Throughput benchmark for the status snapshot formats.
+
+Saves and loads a synthetic 100k-build status snapshot in each format, checks
+that it round-trips, and reports the times and file sizes. Run directly:
+
+  python tests/status_snapshot.py [num_builds]
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from llvmlab.ci import snapshot
+from llvmlab.ci import status
+
+import synthetic
+
+def make_data(num_builds):
+    return status.Status(None, synthetic.make_builders(num_builds)).todata()
+
+def main():
+    if len(sys.argv) > 1:
+        num_builds = int(sys.argv[1])
+    else:
+        num_builds = 100000
+
+    # Round-trip the data once, so it compares equal to the loaded data.
+    path = tempfile.mkdtemp()
+    try:
+        snapshot_path = os.path.join(path, 'lab-status.json')
+        snapshot.save(make_data(num_builds), snapshot_path)
+        data = snapshot.load(snapshot_path)
+
+        print "Snapshot formats for a status of %d builds:" % (num_builds,)
+        for format in snapshot.formats:
+            start_time = time.time()
+            snapshot.save(data, snapshot_path, format)
+            save_time = time.time() - start_time
+
+            start_time = time.time()
+            loaded = snapshot.load(snapshot_path)
+            load_time = time.time() - start_time
+            assert loaded == data
+
+            print ("  %-7s: save %.2fs, load %.2fs, %6d KB" % (
+                    format, save_time, load_time,
+                    os.path.getsize(snapshot_path) // 1024))
+    finally:
+        shutil.rmtree(path)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+"""
+Startup benchmark for the dashboard.
+
+Writes a synthetic lab-status.json with 100k builds, then measures the time
+from creating the app to serving the first request, with all builds loaded at
+startup and with lazy startup (see STATUS_STARTUP_BUILDS). Run directly:
+
+  python tests/status_startup.py [num_builds]
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import flask
+
+import llvmlab.data
+from llvmlab.ci import status
+from llvmlab.ui import app
+
+import synthetic
+
+def write_status(path, num_builds):
+    builders = synthetic.make_builders(num_builds)
+    file = open(path, 'w')
+    flask.json.dump(status.Status(None, builders).todata(), file)
+    file.close()
+
+def measure(install_path, startup_builds):
+    config = dict(app.App.create_test_instance().config)
+    config['INSTALL_PATH'] = install_path
+    config['STATUS_PERSISTENCE'] = 'snapshot'
+    config['STATUS_STARTUP_BUILDS'] = startup_builds
+
+    start_time = time.time()
+    instance = app.App.create_standalone(
+        config, llvmlab.data.Data(users = [], machines = []))
+    rv = instance.test_client().get('/')
+    assert rv.status_code == 200
+    first_request_time = time.time() - start_time
+
+    # Wait for any deferred builds to be loaded.
+    st = instance.config.status
+    while 1:
+        with st.lock:
+            if not st.pending_builds:
+                break
+        time.sleep(.01)
+    loaded_time = time.time() - start_time
+
+    return first_request_time, loaded_time
+
+def main():
+    if len(sys.argv) > 1:
+        num_builds = int(sys.argv[1])
+    else:
+        num_builds = 100000
+
+    install_path = tempfile.mkdtemp()
+    try:
+        write_status(os.path.join(install_path, 'lab-status.json'),
+                     num_builds)
+
+        print "Startup time for a status of %d builds:" % (num_builds,)
+        for startup_builds in (None, 100):
+            first_request_time,loaded_time = measure(install_path,
+                                                     startup_builds)
+            print ("  STATUS_STARTUP_BUILDS = %-4r: first request after %.2fs,"
+                   " all builds loaded after %.2fs" % (
+                    startup_builds, first_request_time, loaded_time))
+    finally:
+        shutil.rmtree(install_path)
+
+if __name__ == '__main__':
+    main()
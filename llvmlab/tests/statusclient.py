@@ -0,0 +1,527 @@
+import BaseHTTPServer
+import gzip
+import hashlib
+import logging
+import os
+import shutil
+import SocketServer
+import StringIO
+import tempfile
+import threading
+import time
+import unittest
+import urlparse
+
+from flask import json
+
+import llvmlab.ci.status
+from llvmlab.ci.buildbot import statusclient
+from llvmlab.ui import app
+
+class FakeMasterServer(SocketServer.ThreadingMixIn,
+                       BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+class FakeMasterHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        master = self.server.master
+        master.requests.append(self.path)
+        if master.delay:
+            time.sleep(master.delay)
+        path,_,query = self.path.partition('?')
+        obj = master.results.get(path)
+        selected = urlparse.parse_qs(query).get('select')
+        if obj is not None and selected:
+            obj = dict((id, master.results.get(path + '/' + id,
+                                               { 'error' : 'Not available' }))
+                       for id in selected)
+        if obj is None:
+            self.send_error(404)
+            return
+
+        data = json.dumps(obj)
+        etag = '"%s"' % hashlib.md5(data).hexdigest()
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header('ETag', etag)
+        self.send_header('Content-Type', 'application/json')
+        if 'gzip' in self.headers.get('Accept-Encoding', ''):
+            os = StringIO.StringIO()
+            file = gzip.GzipFile(fileobj = os, mode = 'wb')
+            file.write(data)
+            file.close()
+            data = os.getvalue()
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+class FakeMaster(object):
+    """
+    A local stand-in for the buildbot JSON interface, serving canned results
+    keyed by request path.
+    """
+
+    def __init__(self):
+        self.results = {}
+        self.requests = []
+        self.delay = 0
+        self.server = FakeMasterServer(('127.0.0.1', 0), FakeMasterHandler)
+        self.server.master = self
+        self.url = 'http://127.0.0.1:%d' % self.server.server_address[1]
+        self.thread = threading.Thread(target = self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.server = None
+
+    def add_builder(self, name, builds):
+        builders = self.results.setdefault('/json/builders', {})
+        builders[name] = {}
+        self.results['/json/builders/%s/builds' % name] = {}
+        for build in builds:
+            self.results['/json/builders/%s/builds/%d' % (
+                    name, build['number'])] = build
+        if builds:
+            self.results['/json/builders/%s/builds/-1' % name] = builds[-1]
+
+def make_build(number, end_time = 20.0, result = 0, builder = 'builder'):
+    return { 'builderName' : builder,
+             'number' : number,
+             'times' : [10.0, end_time],
+             'results' : result,
+             'slave' : 'slave-%d' % (number % 2),
+             'sourceStamp' : { 'revision' : str(100 + number) } }
+
+class TestStatusClient(unittest.TestCase):
+    def setUp(self):
+        self.master = FakeMaster()
+
+    def tearDown(self):
+        if self.master.server is not None:
+            self.master.stop()
+
+    def pull_sweep(self, client):
+        for builder in client.builders.values():
+            client.schedule_builder(builder, -1)
+        return list(client.pull_events())
+
+    def test_concurrent_poll_order(self):
+        names = ['builder-%d' % i for i in range(8)]
+        for name in names:
+            self.master.add_builder(name, [make_build(0)])
+
+        sequential = statusclient.StatusClient(self.master.url)
+        concurrent = statusclient.StatusClient(self.master.url, pool_size = 4)
+        sequential_events = self.pull_sweep(sequential)
+        concurrent_events = self.pull_sweep(concurrent)
+
+        for name in names:
+            self.master.add_builder(name, [make_build(0), make_build(1, None),
+                                           make_build(2)])
+        sequential_events.extend(self.pull_sweep(sequential))
+        concurrent_events.extend(self.pull_sweep(concurrent))
+
+        # The concurrent client sees the same events, in the same per-builder
+        # order.
+        self.assertEqual(sorted(sequential_events), sorted(concurrent_events))
+        for name in names:
+            self.assertEqual(
+                [e for e in sequential_events if e[1:2] == (name,)],
+                [e for e in concurrent_events if e[1:2] == (name,)])
+        self.assertEqual(concurrent.builders['builder-0'].active_builds,
+                         set([1]))
+
+    def test_concurrent_poll_failure(self):
+        names = ['builder-%d' % i for i in range(6)]
+        for name in names:
+            self.master.add_builder(name, [make_build(0), make_build(1)])
+        client = statusclient.StatusClient(self.master.url, pool_size = 4)
+        client.logger = logging.getLogger('test')
+        client.logger.addHandler(logging.NullHandler())
+        client.logger.propagate = False
+
+        # Fail to fetch one builder.
+        fetch_builder = client.fetch_builder
+        def failing_fetch_builder(builder, *args):
+            if builder.name == 'builder-0':
+                raise RuntimeError, "poll failed"
+            return fetch_builder(builder, *args)
+        client.fetch_builder = failing_fetch_builder
+
+        # The events of every other builder are still delivered.
+        events = self.pull_sweep(client)
+        for name in names[1:]:
+            self.assertEqual([e for e in events if e[1:2] == (name,)],
+                             [('added_builder', name),
+                              ('reset_builder', name),
+                              ('add_build', name, 1),
+                              ('completed_build', name, 1)])
+        self.assertEqual([e for e in events if e[1:2] == ('builder-0',)],
+                         [('added_builder', 'builder-0')])
+        self.assertEqual(client.builders['builder-0'].failures, 1)
+        self.assertEqual(client.builders['builder-1'].failures, 0)
+
+    def test_concurrent_poll_stopped(self):
+        names = ['builder-%d' % i for i in range(6)]
+        for name in names:
+            self.master.add_builder(name, [make_build(0)])
+        client = statusclient.StatusClient(self.master.url, pool_size = 4)
+        self.pull_sweep(client)
+
+        # Stop consuming a sweep after the first event.
+        for name in names:
+            self.master.add_builder(name, [make_build(0), make_build(1)])
+        events = client.pull_events()
+        for builder in client.builders.values():
+            client.schedule_builder(builder, -1)
+        delivered = [events.next()]
+        events.close()
+
+        # The events which weren't delivered are reported by the next sweeps.
+        for i in range(2):
+            delivered.extend(client.pull_events())
+        for name in names:
+            self.assertEqual([e for e in delivered if e[1:2] == (name,)],
+                             [('add_build', name, 1),
+                              ('completed_build', name, 1)])
+            self.assertEqual(client.builders[name].last_build_number, 1)
+        self.assertEqual(client.fetching, {})
+
+    def test_pool_resize(self):
+        for i in range(2):
+            self.master.add_builder('builder-%d' % i, [make_build(0)])
+        client = statusclient.StatusClient(self.master.url, pool_size = 4)
+        self.pull_sweep(client)
+        pool = client.pool
+        self.assertEqual(len(pool.threads), 4)
+
+        # Resizing the pool stops the old workers.
+        client.set_pool_size(2)
+        for thread in pool.threads:
+            thread.join(5.0)
+            self.assertFalse(thread.is_alive())
+
+    def test_batched_builds(self):
+        self.master.add_builder('builder', [make_build(0)])
+        client = statusclient.StatusClient(self.master.url)
+        self.pull_sweep(client)
+
+        self.master.add_builder('builder', [make_build(i, [20.0, None][i % 2])
+                                            for i in range(10)])
+        del self.master.requests[:]
+        events = self.pull_sweep(client)
+        self.assertEqual([e for e in events if e[0] == 'add_build'],
+                         [('add_build', 'builder', i) for i in range(1, 10)])
+
+        # The latest build and the active builds are fetched in one request, and
+        # the remaining new builds in another.
+        self.assertEqual(len(self.master.requests), 2)
+
+        # The monitor reuses the results from the sweep.
+        for i in range(1, 10):
+            self.assertEqual(client.get_build('builder', i)['number'], i)
+        self.assertEqual(len(self.master.requests), 2)
+
+    def test_connection_reuse(self):
+        for i in range(4):
+            self.master.add_builder('builder-%d' % i, [make_build(0)])
+        client = statusclient.StatusClient(self.master.url, pool_size = 2)
+        self.pull_sweep(client)
+        self.pull_sweep(client)
+
+        pool = client.connection_pool
+        self.assertTrue(pool.connections_created <= 2)
+        self.assertEqual(pool.connections_created + pool.connections_reused,
+                         len(self.master.requests))
+
+    def test_response_cache(self):
+        self.master.add_builder('builder', [make_build(0)])
+        client = statusclient.StatusClient(self.master.url)
+        self.pull_sweep(client)
+
+        # Unchanged results are revalidated.
+        client.next_builders_poll = -1
+        self.pull_sweep(client)
+        self.assertEqual(client.response_cache.hits, 2)
+
+        # Completed builds are never refetched.
+        client.build_cache = {}
+        del self.master.requests[:]
+        self.assertEqual(client.get_build('builder', 0)['number'], 0)
+        self.assertEqual(self.master.requests, [])
+
+    def test_response_cache_reset(self):
+        def make_new_build(number):
+            build = make_build(number)
+            build['sourceStamp']['revision'] = 'NEW%d' % number
+            return build
+
+        self.master.add_builder('builder', [make_build(i) for i in range(4)])
+        client = statusclient.StatusClient(self.master.url)
+        self.pull_sweep(client)
+        self.pull_sweep(client)
+        self.assertEqual(client.get_build('builder', 3)['sourceStamp'],
+                         { 'revision' : '103' })
+
+        # The master's build history restarts, and reuses the build numbers.
+        self.master.add_builder('builder', [make_new_build(i)
+                                            for i in range(3)])
+        events = self.pull_sweep(client)
+        self.assertTrue(('reset_builder', 'builder') in events)
+        self.master.add_builder('builder', [make_new_build(i)
+                                            for i in range(5)])
+        client.build_cache = {}
+        events = self.pull_sweep(client)
+        self.assertEqual([e for e in events if e[0] == 'add_build'],
+                         [('add_build', 'builder', 3),
+                          ('add_build', 'builder', 4)])
+        self.assertEqual(client.get_build('builder', 3)['sourceStamp'],
+                         { 'revision' : 'NEW3' })
+
+        # Removed builders are forgotten too.
+        del self.master.results['/json/builders']['builder']
+        client.next_builders_poll = -1
+        self.pull_sweep(client)
+        self.assertEqual(client.response_cache.invalidate_prefix(
+                '/json/builders/builder/'), 0)
+
+    def test_adaptive_schedule(self):
+        self.master.add_builder('active', [make_build(0), make_build(1, None)])
+        self.master.add_builder('idle', [make_build(0)])
+        client = statusclient.StatusClient(self.master.url,
+                                           builder_poll_rate = 5.0,
+                                           idle_poll_limit = 20.0)
+        for i in range(4):
+            self.pull_sweep(client)
+
+        # Active builders are polled at the builder poll rate, idle builders
+        # back off up to the limit.
+        self.assertEqual(client.builders['active'].poll_interval, 5.0)
+        self.assertEqual(client.builders['idle'].poll_interval, 20.0)
+
+        # Nothing else is due yet.
+        next_poll = client.get_next_poll_time()
+        self.assertTrue(next_poll > time.time())
+        self.assertEqual(next_poll, client.builders['active'].next_poll)
+        del self.master.requests[:]
+        self.assertEqual(list(client.pull_events()), [])
+        self.assertEqual(self.master.requests, [])
+
+        # Failures back off.
+        client.logger = logging.getLogger('test')
+        client.logger.addHandler(logging.NullHandler())
+        client.logger.propagate = False
+        self.master.stop()
+        client.connection_pool.close()
+        self.pull_sweep(client)
+        for builder in client.builders.values():
+            self.assertEqual(builder.failures, 1)
+            self.assertTrue(builder.next_poll - time.time() >= 2.0)
+
+    def test_push_packet(self):
+        self.master.add_builder('builder', [make_build(0)])
+        client = statusclient.StatusClient(self.master.url)
+        self.pull_sweep(client)
+
+        del self.master.requests[:]
+        started = { 'event' : 'buildStarted',
+                    'payload' : { 'build' : make_build(1, None) } }
+        finished = { 'event' : 'buildFinished',
+                     'payload' : { 'build' : make_build(1) } }
+        self.assertEqual(list(client.push_packet(started)),
+                         [('add_build', 'builder', 1)])
+        self.assertEqual(list(client.push_packet(finished)),
+                         [('completed_build', 'builder', 1)])
+        self.assertEqual(client.get_build('builder', 1)['times'], [10.0, 20.0])
+        self.assertEqual(self.master.requests, [])
+
+        # Pushed results are not trusted beyond the current sweep.
+        self.assertEqual(client.response_cache.get(
+                '/json/builders/builder/builds/1'), None)
+
+        # A build far ahead of what we know about is polled for instead.
+        bogus = { 'event' : 'buildFinished',
+                  'payload' : { 'build' : make_build(10 ** 9) } }
+        self.assertEqual(list(client.push_packet(bogus)), [])
+        self.assertEqual(client.builders['builder'].last_build_number, 1)
+        self.assertEqual(client.get_next_poll_time(), -1)
+
+class AppTestCase(unittest.TestCase):
+    """
+    Base class for tests of an app instance monitoring fake masters, each with
+    a single builder. The first master is the main one.
+    """
+
+    num_masters = 1
+
+    def configure(self, instance):
+        # Set any additional configuration for the instance.
+        pass
+
+    def setUp(self):
+        self.masters = [FakeMaster() for i in range(self.num_masters)]
+        for master in self.masters:
+            master.add_builder('builder', [make_build(0)])
+        self.master = self.masters[0]
+        self.install_path = tempfile.mkdtemp()
+
+        instance = app.App.create_test_instance()
+        instance.config['INSTALL_PATH'] = self.install_path
+        self.configure(instance)
+        instance.load_status(llvmlab.ci.status.Status(self.master.url, {}))
+        self.status = instance.config.status
+        self.instance = instance
+        self.client = instance.test_client()
+
+    def tearDown(self):
+        # Save any pending changes, and stop saving the status (the install
+        # directory is about to be removed).
+        if self.instance.monitor:
+            self.instance.monitor.checkpointer.flush()
+            self.instance.monitor.checkpointer.stop()
+        for master in self.masters:
+            master.stop()
+        shutil.rmtree(self.install_path)
+
+    def wait_for(self, predicate):
+        for i in range(100):
+            if predicate():
+                return
+            time.sleep(.05)
+        self.fail("timeout waiting for status")
+
+class TestStatusPush(AppTestCase):
+    def configure(self, instance):
+        instance.config['STATUS_PUSH_ENABLED'] = True
+
+    def test_push(self):
+        self.client.get('/')
+        self.wait_for(lambda: 'builder' in self.status.build_map and
+                      0 in self.status.build_map['builder'])
+
+        packets = [{ 'event' : 'buildStarted',
+                     'payload' : { 'build' : make_build(1, None) } }]
+        rv = self.client.post('/ci/push',
+                              data = { 'packets' : json.dumps(packets) })
+        self.assertEqual(rv.status_code, 200)
+        self.wait_for(lambda: 1 in self.status.build_map['builder'])
+        self.assertEqual(self.status.build_map['builder'][1].end_time, None)
+
+        packets = [{ 'event' : 'buildFinished',
+                     'payload' : { 'build' : make_build(1) } }]
+        self.client.post('/ci/push', data = { 'packets' : json.dumps(packets) })
+        self.wait_for(lambda: self.status.build_map['builder'][1].end_time)
+
+    def test_push_invalid(self):
+        self.client.get('/')
+        self.wait_for(lambda: 'builder' in self.status.build_map and
+                      0 in self.status.build_map['builder'])
+
+        # Badly shaped packets are rejected.
+        for packets in ({}, [1], [{ 'payload' : [] }],
+                        [{ 'payload' : { 'build' : 'builder' } }],
+                        [{ 'payload' : { 'build' : { 'builderName' : 1 } } }]):
+            rv = self.client.post('/ci/push',
+                                  data = { 'packets' : json.dumps(packets) })
+            self.assertEqual(rv.status_code, 400)
+
+        # A bad packet which gets to the monitor is logged and skipped, without
+        # losing the packets after it.
+        errors = []
+        self.instance.logger.error = errors.append
+        self.instance.monitor.push_packets(
+            [1, { 'event' : 'buildStarted',
+                  'payload' : { 'build' : make_build(1, None) } }])
+        self.wait_for(lambda: 1 in self.status.build_map['builder'])
+        self.assertEqual(len(errors), 1)
+        self.assertTrue('bad status packet' in errors[0])
+
+    def test_monitor_started_once(self):
+        # Concurrent first requests only start one monitor.
+        start_monitor = self.status.start_monitor
+        calls = []
+        def slow_start_monitor(app):
+            calls.append(app)
+            time.sleep(.2)
+            return start_monitor(app)
+        self.status.start_monitor = slow_start_monitor
+
+        threads = [threading.Thread(target = self.instance.test_client().get,
+                                    args = ('/',))
+                   for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(calls), 1)
+
+    def test_push_secret(self):
+        self.instance.config['STATUS_PUSH_SECRET'] = 'sekrit'
+        packets = json.dumps([])
+        rv = self.client.post('/ci/push', data = { 'packets' : packets })
+        self.assertEqual(rv.status_code, 403)
+        rv = self.client.post('/ci/push', data = { 'packets' : packets,
+                                                   'secret' : 'wrong' })
+        self.assertEqual(rv.status_code, 403)
+        rv = self.client.post('/ci/push', data = { 'packets' : packets,
+                                                   'secret' : 'sekrit' })
+        self.assertNotEqual(rv.status_code, 403)
+
+    def test_checkpoint(self):
+        self.client.get('/')
+        self.wait_for(lambda: 'builder' in self.status.build_map and
+                      0 in self.status.build_map['builder'])
+
+        # Events are not saved immediately.
+        checkpointer = self.instance.monitor.checkpointer
+        status_path = os.path.join(self.install_path, 'lab-status.json')
+        self.assertTrue(checkpointer.unsaved_events > 0)
+        self.assertFalse(os.path.exists(status_path))
+
+        checkpointer.flush()
+        self.assertEqual(checkpointer.unsaved_events, 0)
+        file = open(status_path)
+        data = json.load(file)
+        file.close()
+        self.assertEqual(data['builders'][0][1][0]['number'], 0)
+
+class TestFederation(AppTestCase):
+    num_masters = 2
+
+    def configure(self, instance):
+        instance.config['STATUS_MASTERS'] = { 'other' : {
+                'url' : self.masters[1].url, 'poll_workers' : 2 } }
+
+    def test_merged_builders(self):
+        self.client.get('/')
+        for name in ('builder', 'other/builder'):
+            self.wait_for(lambda: 0 in self.status.build_map.get(name, {}))
+        self.assertEqual(self.status.monitors['other'].statusclient.pool_size,
+                         2)
+        self.assertEqual(self.status.get_builder_url('other/builder'),
+                         self.masters[1].url + '/builders/builder')
+        self.assertEqual(self.status.todata()['masters'].keys(), ['other'])
+
+    def test_slow_master(self):
+        # A slow master doesn't hold up the others.
+        self.masters[1].delay = 2.
+        self.client.get('/')
+        self.wait_for(lambda: 0 in self.status.build_map.get('builder', {}))
+        self.assertFalse('other/builder' in self.status.builders)
+
+if __name__ == '__main__':
+    unittest.main()
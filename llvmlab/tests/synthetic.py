@@ -0,0 +1,35 @@
+"""
+Synthetic CI status data for the benchmarks.
+"""
+
+import random
+
+from llvmlab.ci import status
+
+def make_builders(num_builds, build_class = status.BuildStatus,
+                  num_builders = 100, num_slaves = 50):
+    """
+    make_builders(num_builds, build_class = BuildStatus, num_builders = 100,
+                  num_slaves = 50) -> dict
+
+    Make a reproducible map of builder names to lists of builds, with
+    num_builds builds spread evenly over the builders.
+    """
+
+    rng = random.Random(0)
+    builders = {}
+    builds_per_builder = num_builds // num_builders
+    for i in range(num_builders):
+        name = 'builder-%d' % (i,)
+        builds = builders[name] = []
+        for number in range(builds_per_builder):
+            # Build the strings separately for each build, as they are when
+            # loaded from JSON.
+            start_time = 1.3e9 + number * 600.
+            builds.append(build_class(
+                    u'%s' % (name,), number,
+                    u'%d' % (100000 + number * 3 + rng.randrange(3),),
+                    rng.choice((0, 0, 0, 2)), start_time,
+                    start_time + rng.uniform(300., 3000.),
+                    u'slave-%d' % (rng.randrange(num_slaves),)))
+    return builders
@@ -0,0 +1,125 @@
+# RUN: python %s
+
+# Check that LLVMPoller fetches only the revisions since the last change, and
+# catches up a page at a time without dropping any commits. Also check that the
+# parsing stages run off the reactor thread.
+
+import sys
+import threading
+
+from twisted.internet import defer, reactor
+
+from zorg.buildbot.changes.llvmpoller import LLVMPoller
+
+class FakeRepository(object):
+    def __init__(self):
+        self.head = 1000
+        self.calls = []
+
+    def log(self, args):
+        self.calls.append(args)
+        start, end, limit = self.head, 1, None
+        for arg in args:
+            if arg.startswith('--revision='):
+                first, last = arg[len('--revision='):].split(':')
+                assert last == 'HEAD'
+                start, end = int(first), self.head
+                assert start <= self.head, "no such revision"
+            elif arg.startswith('--limit='):
+                limit = int(arg[len('--limit='):])
+
+        step = 1 if start <= end else -1
+        revisions = range(start, end + step, step)[:limit]
+        lines = ['<?xml version="1.0"?>', '<log>']
+        for revision in revisions:
+            lines.append('<logentry revision="%d"><author>user</author>'
+                         '<paths><path action="M">/llvm/trunk/lib/File%d.cpp'
+                         '</path></paths><msg>Commit %d</msg></logentry>' % (
+                    revision, revision, revision))
+        lines.append('</log>')
+        return defer.succeed('\n'.join(lines))
+
+class FakeMaster(object):
+    def __init__(self):
+        self.changes = []
+
+    def addChange(self, **chdict):
+        self.changes.append(chdict)
+        return defer.succeed(None)
+
+@defer.deferredGenerator
+def run_tests():
+    repository = FakeRepository()
+    poller = LLVMPoller(histmax=10)
+    poller.getProcessOutput = repository.log
+    poller.master = FakeMaster()
+
+    # Record the threads the log is parsed on.
+    parse_threads = set()
+    parse_logs = poller.parse_logs
+    def recording_parse_logs(output):
+        parse_threads.add(threading.current_thread())
+        return parse_logs(output)
+    poller.parse_logs = recording_parse_logs
+
+    # The first poll only finds the starting point.
+    wfd = defer.waitForDeferred(poller.poll())
+    yield wfd
+    wfd.getResult()
+    assert poller.last_change == 1000
+    assert poller.master.changes == []
+    assert len(repository.calls) == 1
+
+    # A quiet poll only fetches the last change.
+    del repository.calls[:]
+    wfd = defer.waitForDeferred(poller.poll())
+    yield wfd
+    wfd.getResult()
+    assert poller.master.changes == []
+    assert len(repository.calls) == 1
+    assert '--revision=1000:HEAD' in repository.calls[0]
+
+    # A few commits are picked up in one call.
+    del repository.calls[:]
+    repository.head = 1003
+    wfd = defer.waitForDeferred(poller.poll())
+    yield wfd
+    wfd.getResult()
+    assert [c['revision'] for c in poller.master.changes] == [
+        '1001', '1002', '1003']
+    assert len(repository.calls) == 1
+
+    # Many more commits than fit in a page are all picked up, in order.
+    del repository.calls[:]
+    del poller.master.changes[:]
+    repository.head = 1058
+    wfd = defer.waitForDeferred(poller.poll())
+    yield wfd
+    wfd.getResult()
+    assert [c['revision'] for c in poller.master.changes] == [
+        str(r) for r in range(1004, 1059)]
+    assert poller.last_change == 1058
+    assert len(repository.calls) == 6
+
+    # The log was parsed off the reactor thread, and each stage was timed.
+    assert parse_threads
+    assert threading.current_thread() not in parse_threads
+    assert sorted(poller.stage_times) == sorted(poller.stages)
+
+    print "OK, caught up %d changes in %d calls" % (
+        len(poller.master.changes), len(repository.calls))
+
+def main():
+    failures = []
+    def run():
+        d = run_tests()
+        d.addErrback(failures.append)
+        d.addBoth(lambda _: reactor.stop())
+    reactor.callWhenRunning(run)
+    reactor.run()
+    if failures:
+        failures[0].printTraceback()
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+# RUN: python %s
+
+# Check the streaming SVN log parser used by LLVMPoller against a DOM parse, and
+# time both on a synthetic log with a 50k-path commit (like a branch copy).
+
+import time
+import xml.dom.minidom
+
+from zorg.buildbot.changes import svnlog
+
+def make_log(num_entries, num_paths):
+    lines = ['<?xml version="1.0"?>', '<log>']
+    for i in range(num_entries):
+        revision = 150000 - i
+        lines.append('<logentry revision="%d">' % revision)
+        if i % 7 != 3:
+            lines.append('<author>user%d</author>' % (i % 13,))
+        lines.append('<date>2012-01-01T00:00:00.000000Z</date>')
+        lines.append('<paths>')
+        # The first entry is the big one.
+        if i == 0:
+            count = num_paths
+        else:
+            count = 1 + i % 5
+        for j in range(count):
+            lines.append('<path kind="file" action="%s">'
+                         '/llvm/trunk/lib/Dir%d/File%d.cpp</path>' % (
+                    'MAD'[j % 3], j % 100, j))
+        lines.append('</paths>')
+        lines.append('<msg>Commit &lt;%d&gt;\n\nDetails.</msg>' % revision)
+        lines.append('</logentry>')
+    # An entry without any paths, and one with an empty message.
+    lines.append('<logentry revision="1"><author>a</author></logentry>')
+    lines.append('<logentry revision="0"><paths></paths><msg></msg>'
+                 '</logentry>')
+    lines.append('</log>')
+    return '\n'.join(lines)
+
+def parse_with_dom(output):
+    # The parse LLVMPoller used to do.
+    def get_text(element, tag_name):
+        try:
+            child_nodes = element.getElementsByTagName(tag_name)[0].childNodes
+            return "".join([t.data for t in child_nodes])
+        except:
+            return "<unknown>"
+
+    doc = xml.dom.minidom.parseString(output)
+    entries = []
+    for el in doc.getElementsByTagName("logentry"):
+        pathlist = el.getElementsByTagName("paths")
+        if pathlist:
+            paths = [(p.getAttribute("action"),
+                      "".join([t.data for t in p.childNodes]))
+                     for p in pathlist[0].getElementsByTagName("path")]
+        else:
+            paths = None
+        entries.append((el.getAttribute("revision"), get_text(el, "author"),
+                        get_text(el, "msg"), paths))
+    return entries
+
+def main():
+    output = make_log(200, 50000)
+
+    start = time.time()
+    expected = parse_with_dom(output)
+    dom_time = time.time() - start
+
+    start = time.time()
+    entries = svnlog.parse_logentries(output)
+    stream_time = time.time() - start
+
+    actual = [(e.revision, e.author, e.msg, e.paths) for e in entries]
+    assert actual == expected, "streaming parse differs from the DOM parse"
+    assert entries[0].revision == '150000'
+    assert len(entries[0].paths) == 50000
+    assert entries[3].author == u'<unknown>'
+    assert entries[-2].paths is None
+    assert entries[-1].paths == [] and entries[-1].msg == u''
+
+    print "Parsed %d entries (%d KB of XML):" % (len(entries),
+                                                 len(output) // 1024)
+    print "  minidom   : %.2fs" % dom_time
+    print "  iterparse : %.2fs" % stream_time
+
+    # Malformed logs are reported as SyntaxError.
+    try:
+        svnlog.parse_logentries('<log><logentry revision="1"></log>')
+    except SyntaxError:
+        pass
+    else:
+        assert False, "expected a parse error"
+
+if __name__ == '__main__':
+    main()
@@ -3,13 +3,14 @@
 # Based on the buildbot.changes.svnpoller.SVNPoller source code.
 
 from twisted.python import log
-from twisted.internet import defer, utils
+from twisted.internet import defer, threads, utils
 
 from buildbot import util
 from buildbot.changes import base
 
-import xml.dom.minidom
-import os, urllib, collections
+from zorg.buildbot.changes import svnlog
+
+import os, time, urllib, collections
 
 class LLVMPoller(base.PollingChangeSource, util.ComparableMixin):
     """
@@ -28,9 +29,15 @@ class LLVMPoller(base.PollingChangeSource, util.ComparableMixin):
 
     parent = None # filled in when we're added
     last_change = None
+    catching_up = False # True while the last page of logs was full.
+    stage_times = None  # Seconds spent in each stage of the last page.
     loop = None
     projects = None  # Projects and branches to watch.
 
+    # The stages of a poll, in order (see poll_pages).
+    stages = ['get_logs', 'parse_logs', 'get_new_logentries',
+              'create_changes', 'submit_changes']
+
     def __init__(self, svnurl=_svnurl, svnuser=None, svnpasswd=None,
                  pollInterval=2*60, histmax=10,
                  svnbin='svn', revlinktmpl=_revlinktmpl, category=None,
@@ -70,7 +77,7 @@ class LLVMPoller(base.PollingChangeSource, util.ComparableMixin):
 
         self.svnbin = svnbin
         self.pollInterval = pollInterval
-        self.histmax = histmax
+        self.histmax = histmax # Log entries fetched per 'svn log' call.
         self.category = category
 
         self.cachepath = cachepath
@@ -100,18 +107,57 @@ class LLVMPoller(base.PollingChangeSource, util.ComparableMixin):
         else:
             log.msg("LLVMPoller(%s): Polling all projects" % self.svnurl)
 
-        d = defer.succeed(None)
-
-        d.addCallback(self.get_logs)
-        d.addCallback(self.parse_logs)
-        d.addCallback(self.get_new_logentries)
-        d.addCallback(self.create_changes)
-        d.addCallback(self.submit_changes)
-        d.addCallback(self.finished_ok)
+        d = self.poll_pages()
         d.addErrback(log.err, 'LLVMPoller: Error in  while polling') # eat errors
 
         return d
 
+    @defer.deferredGenerator
+    def poll_pages(self):
+        # Fetch the new revisions a page (histmax entries) at a time, so we
+        # catch up with all the commits made during an outage without dropping
+        # any, and submit each page before fetching the next.
+        #
+        # Parsing the log and building the changes can take a while for large
+        # commits, so those stages run in the reactor's thread pool, to keep
+        # the master responsive. They only read the poller's configuration;
+        # last_change is only updated on the reactor thread.
+        while True:
+            self.stage_times = {}
+            d = defer.succeed(None)
+            d.addCallback(self.run_stage, 'get_logs', self.get_logs)
+            d.addCallback(self.run_stage, 'parse_logs', self.parse_logs, True)
+            d.addCallback(self.run_stage, 'get_new_logentries',
+                          self.get_new_logentries)
+            d.addCallback(self.run_stage, 'create_changes',
+                          self.create_changes, True)
+            d.addCallback(self.run_stage, 'submit_changes', self.submit_changes)
+            d.addCallback(self.finished_ok)
+
+            wfd = defer.waitForDeferred(d)
+            yield wfd
+            wfd.getResult()
+
+            if not self.catching_up:
+                break
+            log.msg("LLVMPoller(%s): Catching up from change %s" % (self.svnurl, self.last_change))
+
+    def run_stage(self, arg, name, f, in_thread=False):
+        # Run a stage of the poll, in a worker thread if asked to, and record
+        # how long it took (including any wait for the svn command or for a
+        # free worker thread).
+        start = time.time()
+        if in_thread:
+            d = threads.deferToThread(f, arg)
+        else:
+            d = defer.maybeDeferred(f, arg)
+
+        def stage_done(result):
+            self.stage_times[name] = time.time() - start
+            return result
+        d.addCallback(stage_done)
+        return d
+
     def getProcessOutput(self, args):
         # This exists so we can override it during the unit tests.
         d = utils.getProcessOutput(self.svnbin, args, self.environ)
@@ -124,62 +170,62 @@ class LLVMPoller(base.PollingChangeSource, util.ComparableMixin):
             args.extend(["--username=%s" % self.svnuser])
         if self.svnpasswd:
             args.extend(["--password=%s" % self.svnpasswd])
-        args.extend(["--limit=%d" % (self.histmax), self.svnurl])
+        if self.last_change is None:
+            # The first time, we only need the latest revision to start from.
+            args.extend(["--limit=1"])
+        else:
+            # Otherwise get the revisions since the last change, oldest first.
+            # The range starts at last_change itself, as asking for a revision
+            # past HEAD is an error, so fetch one more entry to make progress.
+            args.extend(["--revision=%d:HEAD" % self.last_change,
+                         "--limit=%d" % (self.histmax + 1)])
+        args.extend([self.svnurl])
         d = self.getProcessOutput(args)
         return d
 
     def parse_logs(self, output):
-        # Parse the XML output, return a list of <logentry> nodes.
+        # Parse the XML output, return a list of svnlog.LogEntry records.
         try:
-            doc = xml.dom.minidom.parseString(output)
-        except xml.parsers.expat.ExpatError:
-            log.msg("LLVMPoller(%s): LLVMPoller.parse_logs: ExpatError in '%s'" % (self.svnurl, output))
+            logentries = svnlog.parse_logentries(output)
+        except SyntaxError:
+            log.msg("LLVMPoller(%s): LLVMPoller.parse_logs: ParseError in '%s'" % (self.svnurl, output))
             raise
-        logentries = doc.getElementsByTagName("logentry")
         return logentries
 
     def get_new_logentries(self, logentries):
         last_change = old_last_change = self.last_change
 
-        # Given a list of logentries, calculate new_last_change, and
-        # new_logentries, where new_logentries contains only the ones after
-        # last_change.
+        # Given a list of logentries (see get_logs), calculate new_last_change,
+        # and new_logentries, where new_logentries contains only the ones after
+        # last_change, oldest first.
 
-        new_last_change = None
+        new_last_change = last_change
         new_logentries = []
+        self.catching_up = False
         if logentries:
-            new_last_change = int(logentries[0].getAttribute("revision"))
-
             if last_change is None:
                 # If this is the first time we've been run, ignore any changes
                 # that occurred before now. This prevents a build at every
                 # startup.
+                new_last_change = int(logentries[0].revision)
                 log.msg('LLVMPoller(%s): Starting at change %s' % (self.svnurl, new_last_change))
-            elif last_change == new_last_change:
-                # An unmodified repository will hit this case.
-                log.msg('LLVMPoller(%s): No changes' % self.svnurl)
-                assert len(new_logentries) == 0
-                return [] # No new logentries.
             else:
-                for el in logentries:
-                    if last_change == int(el.getAttribute("revision")):
-                        break
-                    new_logentries.append(el)
-                new_logentries.reverse() # Return the oldest first.
+                new_logentries = [el for el in logentries
+                                  if int(el.revision) > last_change]
+                if not new_logentries:
+                    # An unmodified repository will hit this case.
+                    log.msg('LLVMPoller(%s): No changes' % self.svnurl)
+                    return [] # No new logentries.
+                new_last_change = int(new_logentries[-1].revision)
+
+                # A full page means there may be more revisions to fetch.
+                self.catching_up = len(logentries) > self.histmax
 
         self.last_change = new_last_change
         log.msg('LLVMPoller(%s): Last change set from %s to %s' %
                 (self.svnurl, old_last_change, new_last_change))
         return new_logentries
 
-    def _get_text(self, element, tag_name):
-        try:
-            child_nodes = element.getElementsByTagName(tag_name)[0].childNodes
-            text = "".join([t.data for t in child_nodes])
-        except:
-            text = "<unknown>"
-        return text
-
     def _transform_path(self, path):
         """
         Parses the given path, and returns a three-entry tuple
@@ -240,7 +286,7 @@ class LLVMPoller(base.PollingChangeSource, util.ComparableMixin):
             }
 
         for el in new_logentries:
-            revision = str(el.getAttribute("revision"))
+            revision = str(el.revision)
 
             revlink = ''
 
@@ -249,23 +295,19 @@ class LLVMPoller(base.PollingChangeSource, util.ComparableMixin):
                     revlink = self.revlinktmpl % urllib.quote_plus(revision)
 
             log.msg("LLVMPoller(%s): Adding change revision %s" % (self.svnurl, revision))
-            author   = self._get_text(el, "author")
-            comments = self._get_text(el, "msg")
+            author   = el.author
+            comments = el.msg
             # there is a "date" field, but it provides localtime in the
             # repository's timezone, whereas we care about buildmaster's
             # localtime (since this will get used to position the boxes on
             # the Waterfall display, etc). So ignore the date field, and
             # addChange will fill in with the current time
             branches = {}
-            try:
-                pathlist = el.getElementsByTagName("paths")[0]
-            except IndexError: # weird, we got an empty revision
+            if el.paths is None: # weird, we got an empty revision
                 log.msg("LLVMPoller(%s): Ignoring commit with no paths." % self.svnurl)
                 continue
 
-            for p in pathlist.getElementsByTagName("path"):
-                action = p.getAttribute("action")
-                path = "".join([t.data for t in p.childNodes])
+            for action, path in el.paths:
                 # the rest of buildbot is certaily not yet ready to handle
                 # unicode filenames, because they get put in RemoteCommands
                 # which get sent via PB to the buildslave, and PB doesn't
@@ -321,5 +363,8 @@ class LLVMPoller(base.PollingChangeSource, util.ComparableMixin):
             f.write(str(self.last_change))
             f.close()
 
+        log.msg("LLVMPoller(%s): Stage times: %s" % (self.svnurl, ", ".join(
+                    "%s %.3fs" % (name, self.stage_times[name])
+                    for name in self.stages if name in self.stage_times)))
         log.msg("LLVMPoller: Finished polling with res %s" % res)
         return res
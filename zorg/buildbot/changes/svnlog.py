@@ -0,0 +1,92 @@
+# Streaming parser for the output of 'svn log --xml --verbose'.
+
+# Large commits (branch copies, tags) can touch tens of thousands of paths, so
+# rather than building a DOM of the whole log, we parse it incrementally and
+# keep only a light record of each <logentry>, freeing the elements as soon as
+# they have been consumed.
+
+try:
+    import xml.etree.cElementTree as ElementTree
+except ImportError:
+    import xml.etree.ElementTree as ElementTree
+
+import StringIO
+
+class LogEntry(object):
+    """
+    A single <logentry> of an SVN log.
+
+    paths is a list of (action, path) tuples, or None if the entry had no
+    <paths> element at all. Missing author or msg elements are reported as
+    '<unknown>'.
+    """
+
+    __slots__ = ('revision', 'author', 'msg', 'paths')
+
+    def __init__(self, revision, author=u'<unknown>', msg=u'<unknown>',
+                 paths=None):
+        self.revision = revision
+        self.author = author
+        self.msg = msg
+        self.paths = paths
+
+    def __repr__(self):
+        return 'LogEntry(%r, %r, %r, %r)' % (self.revision, self.author,
+                                             self.msg, self.paths)
+
+def _get_text(elem):
+    # Keep the text as unicode, as minidom did.
+    text = elem.text or u''
+    if not isinstance(text, unicode):
+        text = unicode(text)
+    return text
+
+def iter_logentries(file):
+    """
+    Parse the XML log from the given file object, yielding a LogEntry for
+    each <logentry>, in the order they appear in the log.
+
+    Raises SyntaxError (ElementTree's ParseError) on malformed XML.
+    """
+
+    context = iter(ElementTree.iterparse(file, events=('start', 'end')))
+
+    # The root <log> element; its children are removed once consumed.
+    _, root = next(context)
+
+    entry = None
+    paths_elem = None
+    for event, elem in context:
+        tag = elem.tag
+        if event == 'start':
+            if tag == 'logentry':
+                entry = LogEntry(elem.get('revision'))
+            elif tag == 'paths' and entry is not None:
+                entry.paths = []
+                paths_elem = elem
+            continue
+
+        if entry is None:
+            continue
+        if tag == 'path':
+            entry.paths.append((elem.get('action'), _get_text(elem)))
+            # Drop the consumed <path>, so a huge commit doesn't build up a
+            # tree of them.
+            paths_elem.clear()
+        elif tag == 'author':
+            entry.author = _get_text(elem)
+        elif tag == 'msg':
+            entry.msg = _get_text(elem)
+        elif tag == 'paths':
+            paths_elem = None
+        elif tag == 'logentry':
+            yield entry
+            entry = None
+            root.clear()
+
+def parse_logentries(output):
+    """
+    Parse the XML log in the given string, returning a list of LogEntry.
+    """
+
+    return list(iter_logentries(StringIO.StringIO(output)))